@@ -0,0 +1,17 @@
+import logging
+import pytest
+
+from pyspark.sql import SparkSession
+
+
+@pytest.fixture(scope="module")
+def sc():
+    logger = logging.getLogger("py4j")
+    logger.setLevel(logging.WARN)
+    spark = (
+        SparkSession.builder.master("local[2]")
+        .appName("my-local-testing-pyspark-context")
+        .getOrCreate()
+    )
+    yield spark.sparkContext
+    spark.stop()
@@ -1,5 +1,5 @@
 import concurrent.futures
-import logging
+import pickle
 import pytest
 import sys
 import numpy as np
@@ -9,7 +9,8 @@ import zappy.spark
 import zarr
 
 from numpy.testing import assert_allclose
-from pyspark.sql import SparkSession
+from zappy.executor.dag import Program
+from zappy.zarr_util import store_value
 
 # add/change to "pywren_ndarray" to run the tests using Pywren (requires Pywren to be installed)
 TESTS = [
@@ -37,6 +38,28 @@ if sys.version_info[0] == 2:
     ]
 
 
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """Counts the number of jobs (calls to map)"""
+
+    num_jobs = 0
+
+    def map(self, *args, **kwargs):
+        self.num_jobs += 1
+        return super(CountingExecutor, self).map(*args, **kwargs)
+
+
+class RecordingStore(dict):
+    """A Zarr store that records the keys written to it"""
+
+    def __init__(self):
+        super(RecordingStore, self).__init__()
+        self.writes = []
+
+    def __setitem__(self, key, value):
+        self.writes.append(key)
+        super(RecordingStore, self).__setitem__(key, value)
+
+
 class TestZappyArray:
     @pytest.fixture()
     def x(self):
@@ -61,18 +84,6 @@ class TestZappyArray:
         z[:] = x.copy()  # write as zarr locally
         return input_file_zarr
 
-    @pytest.fixture(scope="module")
-    def sc(self):
-        logger = logging.getLogger("py4j")
-        logger.setLevel(logging.WARN)
-        spark = (
-            SparkSession.builder.master("local[2]")
-            .appName("my-local-testing-pyspark-context")
-            .getOrCreate()
-        )
-        yield spark.sparkContext
-        spark.stop()
-
     @pytest.fixture(params=TESTS)
     def xd(self, sc, x, xz, chunks, request):
         if request.param == "direct_ndarray":
@@ -403,3 +414,287 @@ class TestZappyArray:
         xd1, xd2 = zappy.executor.asndarrays((xd + 1, xd + 2))
         assert_allclose(xd1, x + 1)
         assert_allclose(xd2, x + 2)
+
+    def test_asndarray_missing_partitions(self):
+        x = np.arange(50.0).reshape(10, 5)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            xd = zappy.executor.from_ndarray(executor, x, (2, 5)) + 1
+            xd[0:2, :]  # shrinks the number of partitions of the shared DAG
+            with pytest.raises(AssertionError):
+                np.asarray(xd)
+
+    def test_asndarrays_different_dags(self):
+        x = np.arange(50.0).reshape(10, 5)
+        with CountingExecutor(max_workers=2) as executor:
+            xd1 = zappy.executor.from_ndarray(executor, x, (2, 5))
+            xd2 = zappy.executor.from_ndarray(executor, x * 2, (2, 5))
+            xd3 = zappy.executor.from_ndarray(executor, x * 3, (5, 5))
+            assert xd1.dag is not xd2.dag
+            y1, y2, y1_plus_one = zappy.executor.asndarrays((xd1, xd2 * 2, xd1 + 1))
+            assert executor.num_jobs == 1  # same number of partitions, so merged
+            assert_allclose(y1, x)
+            assert_allclose(y2, x * 4)
+            assert_allclose(y1_plus_one, x + 1)
+
+            executor.num_jobs = 0
+            y3, y1, y2 = zappy.executor.asndarrays((xd3, xd1, xd2))
+            assert executor.num_jobs == 2  # one job for each number of partitions
+            assert_allclose(y3, x * 3)
+            assert_allclose(y1, x)
+            assert_allclose(y2, x * 2)
+
+    def test_persist(self, x, xd):
+        if not isinstance(xd, zappy.executor.array.ExecutorZappyArray):
+            return
+        xd = xd + 1
+        xd.persist()
+        assert xd.is_persisted
+        assert_allclose(np.asarray(xd), x + 1)
+        assert_allclose(np.asarray(xd * 2), (x + 1) * 2)
+        assert_allclose(np.asarray(np.sum(xd, axis=0)), np.sum(x + 1, axis=0))
+        assert not (xd * 2).is_persisted
+        # a copy reads the persisted chunks, but doesn't own them
+        copy = xd.copy()
+        assert not copy.is_persisted
+        copy.unpersist()
+        assert xd.is_persisted
+        assert_allclose(np.asarray(copy), x + 1)
+        xd.unpersist()
+        assert not xd.is_persisted
+        assert_allclose(np.asarray(xd), x + 1)
+
+    def test_inplace_does_not_modify_other_arrays(self, x, xd):
+        xd = xd + 1
+        cols = xd[:, 1:3]
+        copy = xd.copy()
+        xd += 1
+        assert_allclose(np.asarray(xd), x + 2)
+        assert_allclose(np.asarray(cols), (x + 1)[:, 1:3])
+        assert_allclose(np.asarray(copy), x + 1)
+
+    def test_inplace_does_not_modify_column_slices(self, x, xd):
+        xd = xd + 1
+        cols = xd[:, 1:3]
+        xd += 1
+        xd *= 10
+        assert_allclose(np.asarray(xd), (x + 2) * 10)
+        assert_allclose(np.asarray(cols), (x + 1)[:, 1:3])
+
+    def test_inplace_does_not_modify_row_slices(self, x, xd):
+        if isinstance(xd, zappy.executor.array.ExecutorZappyArray):
+            pytest.skip("a row subset shrinks the DAG it shares with its parent")
+        xd = xd + 1
+        rows = xd[0:2, :]
+        xd *= 10
+        assert_allclose(np.asarray(xd), (x + 1) * 10)
+        assert_allclose(np.asarray(rows), (x + 1)[0:2, :])
+
+    def test_inplace_reuses_chunks(self, x, xd):
+        if not isinstance(xd, zappy.direct.array.DirectZappyArray):
+            return
+        xd = xd + 1
+        chunks = list(xd.local_rows)
+        np.log1p(xd, out=xd)
+        xd *= 2
+        assert all(a is b for a, b in zip(chunks, xd.local_rows))
+        assert_allclose(np.asarray(xd), np.log1p(x + 1) * 2)
+        # result is a different dtype, so can't reuse the chunks
+        xd = xd.astype(int, copy=False)
+        assert not any(a is b for a, b in zip(chunks, xd.local_rows))
+
+    def test_max(self, x, xd):
+        assert np.max(xd) == pytest.approx(np.max(x))
+        assert_allclose(np.asarray(np.max(xd, axis=0)), np.max(x, axis=0))
+        assert_allclose(np.asarray(np.max(xd, axis=1)), np.max(x, axis=1))
+
+    def test_argmin_argmax(self, x, xd):
+        offset_engines = (
+            zappy.direct.array.DirectZappyArray,
+            zappy.executor.array.ExecutorZappyArray,
+        )
+        if not isinstance(xd, offset_engines):
+            pytest.skip("Spark and Beam combine per-chunk indices without row offsets")
+        assert np.argmax(xd) == np.argmax(x)
+        assert np.argmin(xd) == np.argmin(x)
+        assert_allclose(np.asarray(np.argmax(xd, axis=0)), np.argmax(x, axis=0))
+        assert_allclose(np.asarray(np.argmin(xd, axis=0)), np.argmin(x, axis=0))
+
+    def test_tree_reduce(self):
+        x = np.arange(50.0).reshape(10, 5) % 7
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            xd = zappy.executor.from_ndarray(executor, x, (2, 5))
+            xd.tree_reduce_fan_in = 2  # 5 partitions, so 3 levels of combining
+            assert np.sum(xd) == pytest.approx(np.sum(x))
+            assert np.mean(xd) == pytest.approx(np.mean(x))
+            assert np.argmax(xd) == np.argmax(x)
+            assert np.argmin(xd) == np.argmin(x)
+            assert_allclose(np.asarray(np.sum(xd, axis=0)), np.sum(x, axis=0))
+            assert_allclose(np.asarray(np.mean(xd, axis=0)), np.mean(x, axis=0))
+            assert_allclose(np.asarray(np.min(xd, axis=0)), np.min(x, axis=0))
+            assert_allclose(np.asarray(np.max(xd, axis=0)), np.max(x, axis=0))
+            assert_allclose(np.asarray(np.prod(xd, axis=0)), np.prod(x, axis=0))
+            assert_allclose(np.asarray(np.all(xd, axis=0)), np.all(x, axis=0))
+            assert_allclose(np.asarray(np.any(xd, axis=0)), np.any(x, axis=0))
+            assert_allclose(np.asarray(np.argmax(xd, axis=0)), np.argmax(x, axis=0))
+            assert_allclose(np.asarray(np.argmin(xd, axis=0)), np.argmin(x, axis=0))
+            # partial results are removed from the intermediate store
+            assert list(xd.intermediate_group.store.keys()) == [".zgroup"]
+
+    def test_tree_reduce_processes(self, tmpdir):
+        x = np.arange(500.0).reshape(100, 5) % 7
+        with zappy.executor.SharedMemoryExecutor(max_workers=2) as executor:
+            # by default partial results are combined on the driver, so an in-memory
+            # intermediate store works with any number of partitions
+            xd = zappy.executor.from_ndarray(executor, x, (1, 5))
+            assert np.sum(xd) == pytest.approx(np.sum(x))
+            # tasks in other processes reopen a directory store from its path
+            store = zarr.DirectoryStore(str(tmpdir.join("intermediate.zarr")))
+            xd = zappy.executor.from_ndarray(executor, x, (1, 5), store)
+            xd.tree_reduce_fan_in = 8
+            assert np.sum(xd) == pytest.approx(np.sum(x))
+            assert np.mean(xd) == pytest.approx(np.mean(x))
+            assert_allclose(np.asarray(np.sum(xd, axis=0)), np.sum(x, axis=0))
+
+    def test_compute(self):
+        x = np.arange(50.0).reshape(10, 5) % 7
+        with CountingExecutor(max_workers=2) as executor:
+            xd = zappy.executor.from_ndarray(executor, x, (2, 5))
+            total, col_sums, col_max, col_means, plus_one = zappy.compute(
+                np.sum(xd),
+                np.sum(xd, axis=0),
+                np.max(xd, axis=0),
+                np.mean(xd, axis=0),
+                xd + 1,
+            )
+            assert executor.num_jobs == 1  # all read the input once
+            assert total == pytest.approx(np.sum(x))
+            assert_allclose(col_sums, np.sum(x, axis=0))
+            assert_allclose(col_max, np.max(x, axis=0))
+            assert_allclose(col_means, np.mean(x, axis=0))
+            assert_allclose(plus_one, x + 1)
+
+            # reductions are computed lazily, and only once
+            executor.num_jobs = 0
+            mean = np.mean(xd)
+            assert executor.num_jobs == 0
+            assert mean > 0
+            assert mean.computed and executor.num_jobs == 1
+            assert float(mean) == pytest.approx(np.mean(x))
+            assert_allclose(np.asarray(xd - mean), x - np.mean(x))
+
+    def test_lazy_reduction_scalar(self):
+        x = np.arange(50.0).reshape(10, 5) % 7
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            xd = zappy.executor.from_ndarray(executor, x, (2, 5))
+            mean = np.mean(xd)
+            expected = np.mean(x)
+            assert "{:.3f}".format(mean) == "{:.3f}".format(expected)
+            assert "%s" % mean == "%s" % expected
+            assert round(mean) == round(expected)
+            assert round(mean, 2) == round(expected, 2)
+            assert hash(mean) == hash(expected)
+            assert {mean: 1}[expected] == 1
+            assert mean.item() == expected.item()
+            assert isinstance(mean.item(), float)
+            assert mean.dtype == expected.dtype
+            assert mean.shape == ()
+            assert mean.ndim == 0
+            assert complex(mean) == complex(expected)
+            assert isinstance(mean.result(), np.floating)
+            assert np.sum(xd).dtype == np.sum(x).dtype
+
+    def test_copartitioned_column(self):
+        x = np.arange(50.0).reshape(10, 5) + 1
+        with CountingExecutor(max_workers=2) as executor:
+            xd = zappy.executor.from_ndarray(executor, x, (3, 5))
+            y = xd / np.sum(xd, axis=1)[:, np.newaxis]
+            # the row sums are not materialized on the driver
+            assert executor.num_jobs == 0
+            (result,) = zappy.compute(y)
+            assert executor.num_jobs == 1
+            assert_allclose(result, x / np.sum(x, axis=1)[:, np.newaxis])
+
+    def test_compute_stages(self):
+        x = np.arange(50.0).reshape(10, 5) % 7
+        with CountingExecutor(max_workers=2) as executor:
+            xd = zappy.executor.from_ndarray(executor, x, (2, 5))
+            # centering and scaling don't run any jobs until they are computed
+            centered = xd - np.mean(xd, axis=0)
+            std = np.sqrt(np.mean(centered * centered, axis=0))
+            z = centered / std
+            assert executor.num_jobs == 0
+            (result,) = zappy.compute(z)
+            # one job for each reduction, and one for the result
+            assert executor.num_jobs == 3
+            assert_allclose(result, (x - x.mean(axis=0)) / x.std(axis=0))
+
+            executor.num_jobs = 0
+            (centered,) = zappy.compute(xd - np.mean(xd))
+            assert executor.num_jobs == 2
+            assert_allclose(centered, x - np.mean(x))
+            assert_allclose(np.asarray(xd - np.mean(xd)), x - np.mean(x))
+
+    def test_result_store_threshold(self):
+        x = np.arange(50.0).reshape(10, 5)
+        x[8:] = 0
+        store = RecordingStore()
+        with CountingExecutor(max_workers=2) as executor:
+            xd = zappy.executor.from_ndarray(executor, x, (4, 5), store)
+            y = xd + 1
+            y.result_store_threshold = 4 * 5 * 8 - 1  # only full chunks go via the store
+            assert_allclose(np.asarray(y), x + 1)
+            (y1,) = zappy.executor.asndarrays([y])
+            assert_allclose(y1, x + 1)
+            (y2, total) = zappy.compute(y, np.sum(xd))
+            assert_allclose(y2, x + 1)
+            assert_allclose(np.concatenate(y._compute()), x + 1)
+            # the two full chunks were returned via the store for each of the four computations
+            assert len([key for key in store.writes if key.startswith("results/")]) == 8
+            # and removed from the intermediate store once they were read
+            assert list(store.keys()) == [".zgroup"]
+
+    def test_intermediate_store_processes(self, tmpdir):
+        x = np.arange(50.0).reshape(10, 5)
+        store = zarr.DirectoryStore(str(tmpdir.join("intermediate.zarr")))
+        with zappy.executor.SharedMemoryExecutor(max_workers=2) as executor:
+            # tasks in other processes reopen the store from its path to write results and persisted chunks
+            xd = zappy.executor.from_ndarray(executor, x, (2, 5), store)
+            y = (xd + 1).persist()
+            assert any(key.endswith("/0") for key in store.keys())
+            y.result_store_threshold = 0
+            assert_allclose(np.asarray(y), x + 1)
+            assert_allclose(np.asarray(y * 2), (x + 1) * 2)
+
+    def test_operand_store_threshold(self, tmpdir):
+        cloudpickle = pytest.importorskip("cloudpickle")
+        x = np.arange(2000.0).reshape(4, 500)
+        row = np.arange(500.0)
+        columns = np.arange(0, 500, 2)
+        store = zarr.DirectoryStore(str(tmpdir.join("intermediate.zarr")))
+        with zappy.executor.SharedMemoryExecutor(max_workers=2) as executor:
+            xd = zappy.executor.from_ndarray(executor, x, (2, 500), store)
+            program_size = len(cloudpickle.dumps(Program([(xd + row).input])))
+            xd.operand_store_threshold = 1000
+            y = xd + row
+            # the row is not pickled with the function run by each task
+            assert len(cloudpickle.dumps(Program([y.input]))) < program_size - 3000
+            assert_allclose(np.asarray(y), x + row)
+            assert_allclose(np.asarray(xd[:, columns]), x[:, columns])
+            # operands are only written once
+            assert_allclose(np.asarray(xd * row), x * row)
+            assert len([key for key in store.keys() if "operands/" in key]) == 2
+
+    def test_stored_operand_location(self, tmpdir):
+        row = np.arange(500.0)
+        store = zarr.TempStore(dir=str(tmpdir))
+        group = zarr.group(store)
+        for i in range(10):
+            store_value(store, "results/%s" % i, np.ones(1000))
+        operand = zappy.executor.array._store_operand(group, row)
+        # the operand refers to the store by its path, so it doesn't grow with the contents of the store
+        assert operand.location.path == store.path
+        data = pickle.dumps(operand)
+        assert len(data) < 1000
+        operand = pickle.loads(data)
+        zappy.executor.cache.operand_cache.clear()
+        assert_allclose(zappy.executor.array._load_operand(operand), row)
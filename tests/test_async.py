@@ -0,0 +1,71 @@
+import concurrent.futures
+import numpy as np
+import pytest
+import threading
+import zappy.executor
+import zarr
+
+from numpy.testing import assert_allclose
+
+asyncio = pytest.importorskip("asyncio")  # Python 3 only
+
+
+class OverlapExecutor(concurrent.futures.ThreadPoolExecutor):
+    """Only starts a job once the given number of jobs (with different functions) have been started"""
+
+    def __init__(self, jobs, *args, **kwargs):
+        super(OverlapExecutor, self).__init__(*args, **kwargs)
+        self.jobs = jobs
+        self.funcs = []
+        self.condition = threading.Condition()
+
+    def _wait_for_jobs(self, func):
+        with self.condition:
+            if not any(func is f for f in self.funcs):
+                self.funcs.append(func)
+                self.condition.notify_all()
+            if not self.condition.wait_for(
+                lambda: len(self.funcs) >= self.jobs, timeout=10
+            ):
+                raise RuntimeError("Jobs were run one at a time")
+
+    def submit(self, func, *args, **kwargs):
+        self._wait_for_jobs(func)
+        return super(OverlapExecutor, self).submit(func, *args, **kwargs)
+
+    def map(self, func, *iterables, **kwargs):
+        self._wait_for_jobs(func)
+        return super(OverlapExecutor, self).map(func, *iterables, **kwargs)
+
+
+def run(awaitable):
+    return asyncio.get_event_loop().run_until_complete(awaitable)
+
+
+def test_async_jobs_overlap(tmpdir):
+    x = np.arange(50.0).reshape(10, 5)
+    output_file = str(tmpdir.join("y.zarr"))
+    with OverlapExecutor(2, max_workers=4) as executor:
+        xd = zappy.executor.from_ndarray(executor, x, (2, 5))
+        yd = zappy.executor.from_ndarray(executor, x * 2, (2, 5))
+        result, _ = run(
+            asyncio.gather(
+                (xd + 1).asndarray_async(), yd.to_zarr_async(output_file, (2, 5))
+            )
+        )
+        assert_allclose(result, x + 1)
+        assert_allclose(zarr.open(output_file, mode="r")[:], x * 2)
+
+
+def test_async_reductions():
+    from zappy.executor import aio
+
+    x = np.arange(50.0).reshape(10, 5)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        xd = zappy.executor.from_ndarray(executor, x, (2, 5))
+        assert run(xd.sum(axis=None).result_async()) == x.sum()
+        column_means, y = run(aio.compute(np.mean(xd, axis=0), xd * 3))
+        assert_allclose(column_means, np.mean(x, axis=0))
+        assert_allclose(y, x * 3)
+        (z,) = run(aio.asndarrays([xd - 1]))
+        assert_allclose(z, x - 1)
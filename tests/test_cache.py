@@ -0,0 +1,43 @@
+import numpy as np
+
+from zappy.executor.cache import ChunkCache
+
+
+def test_get_and_put():
+    cache = ChunkCache()
+    assert cache.get(("a", 0)) is None
+    chunk = np.zeros((2, 5))
+    cache.put(("a", 0), chunk)
+    assert cache.get(("a", 0)) is chunk
+    assert cache.nbytes == chunk.nbytes
+
+
+def test_evicts_least_recently_used():
+    chunk_bytes = np.zeros((2, 5)).nbytes
+    cache = ChunkCache(max_bytes=2 * chunk_bytes)
+    cache.put(("a", 0), np.zeros((2, 5)))
+    cache.put(("a", 1), np.zeros((2, 5)))
+    cache.get(("a", 0))  # now ("a", 1) is least recently used
+    cache.put(("a", 2), np.zeros((2, 5)))
+    assert ("a", 0) in cache
+    assert ("a", 1) not in cache
+    assert ("a", 2) in cache
+    assert cache.nbytes == 2 * chunk_bytes
+
+
+def test_chunk_larger_than_cache_is_not_cached():
+    cache = ChunkCache(max_bytes=8)
+    cache.put(("a", 0), np.zeros((2, 5)))
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_invalidate():
+    cache = ChunkCache()
+    cache.put(("a", 0), np.zeros((2, 5)))
+    cache.put(("a", 1), np.zeros((2, 5)))
+    cache.put(("b", 0), np.zeros((2, 5)))
+    cache.invalidate("a")
+    assert len(cache) == 1
+    assert ("b", 0) in cache
+    assert cache.nbytes == np.zeros((2, 5)).nbytes
@@ -0,0 +1,113 @@
+import concurrent.futures
+import numpy as np
+import pytest
+import threading
+import time
+import zappy.executor
+import zarr
+
+from numpy.testing import assert_allclose
+from zappy.executor import (
+    AdaptiveConcurrencyExecutor,
+    AIMDPolicy,
+    FixedConcurrencyPolicy,
+    SimulatedObjectStore,
+)
+
+
+def test_aimd_policy():
+    policy = AIMDPolicy(initial_limit=4, max_limit=5)
+    for _ in range(4):
+        policy.record(0.1, throttled=False)
+    assert policy.limit() == 4  # about one more for each limit's worth of tasks
+    policy.record(0.1, throttled=False)
+    assert policy.limit() == 5
+    for _ in range(20):
+        policy.record(0.1, throttled=False)
+    assert policy.limit() == 5  # capped
+    policy.record(0.1, throttled=True)
+    assert policy.limit() == 2
+    policy.record(0.1, throttled=True)
+    assert policy.limit() == 2  # a burst of throttling only decreases once
+    policy.record(0.1, throttled=False)
+    policy.record(0.1, throttled=True)
+    assert policy.limit() == 1
+
+
+def test_aimd_policy_latency_threshold():
+    policy = AIMDPolicy(initial_limit=8, latency_threshold=1.0)
+    policy.record(0.5, throttled=False)
+    assert policy.limit() == 8
+    policy.record(2.0, throttled=False)
+    assert policy.limit() == 4
+
+
+class InFlight(object):
+    """Adds one to its argument, recording the maximum number of concurrent calls"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __call__(self, x):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        return x + 1
+
+
+def test_adaptive_concurrency_executor_limit():
+    func = InFlight()
+    with AdaptiveConcurrencyExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=8),
+        FixedConcurrencyPolicy(3),
+    ) as executor:
+        assert list(executor.map(func, range(10))) == list(range(1, 11))
+        assert func.max_in_flight == 3
+
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError("3")
+    return x + 1
+
+
+def test_adaptive_concurrency_executor_failure():
+    with AdaptiveConcurrencyExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2)
+    ) as executor:
+        with pytest.raises(ValueError):
+            list(executor.map(fail_on_three, range(6)))
+        assert executor.throttled == 0
+
+
+def test_adaptive_concurrency_executor_throttling():
+    x = np.arange(400.0).reshape(40, 10)
+    store = SimulatedObjectStore(latency=0.01, capacity=4, seed=0)
+    policy = AIMDPolicy(initial_limit=16)
+    with AdaptiveConcurrencyExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=16), policy, max_attempts=10
+    ) as executor:
+        xd = zappy.executor.from_ndarray(executor, x, (2, 10))
+        xd.to_zarr(store, (2, 10))
+        assert executor.throttled > 0
+        assert store.throttled == executor.throttled
+        assert policy.limit() < 16
+        assert len(executor.history) > 0
+        assert_allclose(zarr.open(store, mode="r")[:], x)
+
+
+def test_simulated_object_store():
+    store = SimulatedObjectStore(latency=0, capacity=1)
+    store["a"] = b"1"
+    assert store["a"] == b"1"
+    assert "a" in store
+    assert list(store) == ["a"]
+    del store["a"]
+    assert len(store) == 0
+    assert store.requests == 3
+    assert store.throttled == 0
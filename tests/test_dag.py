@@ -1,6 +1,7 @@
 import concurrent.futures
 import pytest
-from zappy.executor.dag import DAG
+import time
+from zappy.executor.dag import DAG, Program
 
 
 def add_one(x):
@@ -72,3 +73,179 @@ def test_dag_multiple_transforms():
     inter = dag.transform(add_one, [input])
     output = dag.transform(add_one, [inter])
     assert list(dag.compute(output)) == [4, 5, 7]
+
+
+def test_dag_shared_subexpression_computed_once():
+    calls = []
+
+    def counting_add_one(x):
+        calls.append(x)
+        return x + 1
+
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([2, 3, 5])
+    shared = dag.transform(counting_add_one, [input])
+    left = dag.transform(times_two, [shared])
+    output = dag.transform(add, [left, shared])  # diamond
+    assert list(dag.compute(output)) == [9, 12, 18]
+    assert sorted(calls) == [2, 3, 5]
+
+
+def test_dag_compute_multiple_shares_subexpressions():
+    calls = []
+
+    def counting_add_one(x):
+        calls.append(x)
+        return x + 1
+
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([2, 3])
+    shared = dag.transform(counting_add_one, [input])
+    output1 = dag.transform(times_two, [shared])
+    output2 = dag.transform(add_one, [shared])
+    result1, result2 = dag.compute_multiple([output1, output2])
+    assert list(result1) == [6, 8]
+    assert list(result2) == [4, 5]
+    assert sorted(calls) == [2, 3]
+
+
+class RecordingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """An executor that records the values passed to map."""
+
+    def __init__(self):
+        super(RecordingExecutor, self).__init__()
+        self.mapped = []
+
+    def map(self, fn, *iterables, **kwargs):
+        self.mapped.append([list(iterable) for iterable in iterables])
+        return super(RecordingExecutor, self).map(fn, *self.mapped[-1], **kwargs)
+
+
+def test_unused_inputs_are_not_shipped():
+    executor = RecordingExecutor()
+    dag = DAG(executor)
+    input1 = dag.add_input([2, 3, 5])
+    input2 = dag.add_input([7, 11, 13])
+    dag.add_input(["unused", "unused", "unused"])
+    output = dag.transform(add, [input1, input2])
+    assert list(dag.compute(output)) == [9, 14, 18]
+    (partition_inputs,) = executor.mapped[-1]
+    assert partition_inputs == [(2, 7), (3, 11), (5, 13)]
+
+    result1, result2 = dag.compute_multiple([input1, dag.transform(add_one, [input1])])
+    assert list(result1) == [2, 3, 5]
+    assert list(result2) == [3, 4, 6]
+    (partition_inputs,) = executor.mapped[-1]
+    assert partition_inputs == [(2,), (3,), (5,)]
+
+
+def test_program_is_flat():
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input1 = dag.add_input([2, 3])
+    input2 = dag.add_input([7, 11])
+    shared = dag.transform(add_one, [input2])
+    output = dag.transform(add, [shared, dag.transform(times_two, [shared])])
+    program = Program([output])
+    assert program.input_indices == [1]
+    # one instruction per transform, with inputs before the transforms that use them
+    assert [instruction[0] for instruction in program.instructions] == [
+        add_one,
+        times_two,
+        add,
+    ]
+    assert program((7,)) == 24
+
+
+def test_long_chain_does_not_recurse():
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    output = dag.add_input([0, 1])
+    for _ in range(5000):
+        output = dag.transform(add_one, [output])
+    assert list(dag.compute(output)) == [5000, 5001]
+
+
+class Increment(object):
+    """Adds one to a list, in place if passed the list as its out buffer."""
+
+    reuses_buffers = True
+    owns_result = True
+
+    def __call__(self, x, out=None):
+        if out is x:
+            x[0] += 1
+            return x
+        return [x[0] + 1]
+
+
+def test_program_reuses_dead_owned_buffers():
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([[2], [3]])
+    first = dag.transform(Increment(), [input])
+    second = dag.transform(Increment(), [first])
+    third = dag.transform(Increment(), [second])
+    program = Program([third])
+    # input is not owned by the program, and first is the only one with a later use
+    assert [instruction[4] for instruction in program.instructions] == [
+        None,
+        first_slot(program, 0),
+        first_slot(program, 1),
+    ]
+    partition = [2]
+    assert program((partition,)) == [5]
+    assert partition == [2]  # input not modified
+
+    # a buffer that is used later is not reused
+    output = dag.transform(add, [dag.transform(Increment(), [first]), first])
+    assert list(dag.compute(output)) == [[4, 3], [5, 4]]
+
+
+class Reverse(object):
+    """Returns a reversed view of a list-like value, like a NumPy slice."""
+
+    def __call__(self, x):
+        return x[::-1]
+
+
+class AddInto(object):
+    """Adds two lists elementwise, into the out buffer if one is passed."""
+
+    reuses_buffers = True
+    owns_result = True
+
+    def __call__(self, x, y, out=None):
+        result = [a + b for a, b in zip(x, y)]
+        if out is not None:
+            out[:] = result
+            return out
+        return result
+
+
+def test_program_does_not_reuse_viewed_buffers():
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([[2], [3]])
+    first = dag.transform(Increment(), [input])
+    second = dag.transform(Increment(), [input])
+    # first is released by the add, but the other argument is a view of it
+    output = dag.transform(AddInto(), [first, dag.transform(Reverse(), [first])])
+    assert Program([output]).instructions[-1][4] is None
+    # without a view, it can be reused
+    output = dag.transform(AddInto(), [first, second])
+    assert Program([output]).instructions[-1][4] is not None
+
+
+def first_slot(program, index):
+    return program.instructions[index][2]
+
+
+def test_compute_as_completed():
+    def slow_first(x):
+        if x == 2:
+            time.sleep(0.2)
+        return x + 1
+
+    dag = DAG(concurrent.futures.ThreadPoolExecutor(max_workers=3))
+    input = dag.add_input([2, 3, 5])
+    output = dag.transform(slow_first, [input])
+    results = list(dag.compute_as_completed(output))
+    assert sorted(results) == [(0, 3), (1, 4), (2, 6)]
+    assert results[-1] == (0, 3)
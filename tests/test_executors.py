@@ -0,0 +1,296 @@
+import concurrent.futures
+import json
+import numpy as np
+import pytest
+import threading
+import time
+import zappy.executor
+import zarr
+
+from numpy.testing import assert_allclose
+from zappy.executor import (
+    BatchingExecutor,
+    InstrumentedExecutor,
+    RetryingExecutor,
+    SpeculativeExecutor,
+)
+from zappy.executor.dag import DAG
+from zappy.executor.executors import speculative_map
+
+
+class RecordingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """Records the number of tasks in each job"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingExecutor, self).__init__(*args, **kwargs)
+        self.job_sizes = []
+
+    def map(self, func, *iterables):
+        items = list(zip(*iterables))
+        self.job_sizes.append(len(items))
+        return super(RecordingExecutor, self).map(func, *zip(*items))
+
+
+def add_one(x):
+    return x + 1
+
+
+def test_batching_executor():
+    with RecordingExecutor(max_workers=2) as recording_executor:
+        executor = BatchingExecutor(recording_executor, partitions_per_task=3)
+        assert list(executor.map(add_one, range(10))) == list(range(1, 11))
+        assert recording_executor.job_sizes == [4]
+        assert list(executor.map(add_one, [])) == []
+
+
+def test_batching_executor_dag():
+    with RecordingExecutor(max_workers=2) as recording_executor:
+        dag = DAG(BatchingExecutor(recording_executor, partitions_per_task=2))
+        input = dag.add_input(list(range(5)))
+        output = dag.transform(add_one, [input])
+        assert list(dag.compute(output)) == [1, 2, 3, 4, 5]
+        assert recording_executor.job_sizes == [3]
+
+
+def test_batching_executor_target_task_duration():
+    with RecordingExecutor(max_workers=2) as recording_executor:
+        executor = BatchingExecutor(recording_executor, target_task_duration=10)
+        assert executor.batch_size() == 1  # nothing measured yet
+        list(executor.map(add_one, range(4)))
+        assert recording_executor.job_sizes == [4]
+        assert executor.seconds_per_partition is not None
+        executor.seconds_per_partition = 2.5  # as if measured
+        assert executor.batch_size() == 4
+        list(executor.map(add_one, range(8)))
+        assert recording_executor.job_sizes == [4, 2]
+
+
+def test_batching_executor_array():
+    x = np.arange(50.0).reshape(10, 5)
+    with BatchingExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2), partitions_per_task=2
+    ) as executor:
+        xd = zappy.executor.from_ndarray(executor, x, (3, 5))
+        assert_allclose(np.asarray(xd + 1), x + 1)
+        assert_allclose(np.asarray(np.sum(xd, axis=0)), np.sum(x, axis=0))
+
+
+class Straggler(object):
+    """Adds one to its argument, but the first attempt for 3 is very slow"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = []
+
+    def __call__(self, x):
+        with self.lock:
+            first_attempt = x not in self.attempts
+            self.attempts.append(x)
+        if x == 3 and first_attempt:
+            time.sleep(2)
+        return x + 1
+
+
+def test_speculative_executor():
+    straggler = Straggler()
+    with SpeculativeExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=4), speculation_fraction=0.5
+    ) as executor:
+        start = time.time()
+        assert list(executor.map(straggler, range(6))) == list(range(1, 7))
+        assert time.time() - start < 1  # didn't wait for the straggler
+        assert straggler.attempts.count(3) == 2
+
+
+def test_speculative_map_submit_all():
+    straggler = Straggler()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        submitted_together = []
+        submitted_singly = []
+
+        def submit_all(func, items):
+            submitted_together.append(list(items))
+            return [executor.submit(func, item) for item in items]
+
+        def submit(func, item):
+            submitted_singly.append(item)
+            return executor.submit(func, item)
+
+        results, tasks = speculative_map(
+            submit,
+            lambda fs: concurrent.futures.wait(
+                fs, return_when=concurrent.futures.FIRST_COMPLETED
+            ),
+            straggler,
+            list(range(6)),
+            0.5,
+            submit_all=submit_all,
+        )
+        assert results == list(range(1, 7))
+        # the job is started at once, and only backups are submitted on their own
+        assert submitted_together == [list(range(6))]
+        assert 3 in submitted_singly
+        assert len(tasks[3]) == 2
+
+
+def fail_on_three(x):
+    if x == 3:
+        raise ValueError("3")
+    return x + 1
+
+
+def test_speculative_executor_failure():
+    with SpeculativeExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2), speculation_fraction=0.5
+    ) as executor:
+        with pytest.raises(ValueError):
+            list(executor.map(fail_on_three, range(6)))
+        assert list(executor.map(add_one, [1, 2])) == [2, 3]
+
+
+class Flaky(object):
+    """Adds one to its argument, but fails the first two attempts for odd numbers"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.attempts = []
+
+    def __call__(self, x):
+        with self.lock:
+            self.attempts.append(x)
+            attempt = self.attempts.count(x)
+        if x % 2 == 1 and attempt <= 2:
+            raise IOError("transient failure")
+        return x + 1
+
+
+def test_retrying_executor():
+    flaky = Flaky()
+    with RetryingExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2), backoff=0
+    ) as executor:
+        assert list(executor.map(flaky, range(4))) == [1, 2, 3, 4]
+        # only the failed tasks were retried
+        assert sorted(flaky.attempts) == [0, 1, 1, 1, 2, 3, 3, 3]
+        assert [(i, attempt) for i, attempt, _ in executor.failures] == [
+            (1, 1),
+            (3, 1),
+            (1, 2),
+            (3, 2),
+        ]
+
+
+def test_retrying_executor_gives_up():
+    with RetryingExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2),
+        max_attempts=2,
+        backoff=0,
+    ) as executor:
+        with pytest.raises(IOError):
+            list(executor.map(Flaky(), range(4)))
+
+
+def test_retrying_executor_does_not_retry_bugs():
+    with RetryingExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2), backoff=0
+    ) as executor:
+        with pytest.raises(ValueError):
+            list(executor.map(fail_on_three, range(6)))
+        assert [(i, attempt) for i, attempt, _ in executor.failures] == []
+
+
+class TimingOutExecutor(concurrent.futures.ThreadPoolExecutor):
+    """The first task for 2 times out, outside the task"""
+
+    def __init__(self, *args, **kwargs):
+        super(TimingOutExecutor, self).__init__(*args, **kwargs)
+        self.timed_out = False
+
+    def submit(self, func, *args, **kwargs):
+        if args == (2,) and not self.timed_out:
+            self.timed_out = True
+            future = concurrent.futures.Future()
+            future.set_exception(concurrent.futures.TimeoutError())
+            return future
+        return super(TimingOutExecutor, self).submit(func, *args, **kwargs)
+
+
+def test_retrying_executor_timeout():
+    with RetryingExecutor(TimingOutExecutor(max_workers=2), backoff=0) as executor:
+        assert list(executor.map(add_one, range(4))) == [1, 2, 3, 4]
+        assert [(i, attempt) for i, attempt, _ in executor.failures] == [(2, 1)]
+
+
+class FlakyStore(dict):
+    """A Zarr store where the first write of each of some keys fails"""
+
+    def __init__(self, flaky_keys):
+        super(FlakyStore, self).__init__()
+        self.flaky_keys = set(flaky_keys)
+        self.writes = []
+
+    def __setitem__(self, key, value):
+        self.writes.append(key)
+        if key in self.flaky_keys:
+            self.flaky_keys.remove(key)
+            raise IOError("transient failure writing %s" % key)
+        super(FlakyStore, self).__setitem__(key, value)
+
+
+def test_retrying_executor_to_zarr():
+    x = np.arange(50.0).reshape(10, 5)
+    store = FlakyStore(["2.0"])
+    with RetryingExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2), backoff=0
+    ) as executor:
+        xd = zappy.executor.from_ndarray(executor, x, (2, 5))
+        xd.to_zarr(store, (2, 5))
+        assert [i for i, _, _ in executor.failures] == [2]
+        # only the failed chunk was written again
+        assert sorted(key for key in store.writes if key != ".zarray") == [
+            "0.0",
+            "1.0",
+            "2.0",
+            "2.0",
+            "3.0",
+            "4.0",
+        ]
+        assert_allclose(zarr.open(store)[:], x)
+
+
+def test_instrumented_executor(tmpdir):
+    x = np.arange(50.0).reshape(10, 5)
+    input_file = str(tmpdir.join("x.zarr"))
+    z = zarr.open(input_file, mode="w", shape=x.shape, chunks=(2, 5), dtype=x.dtype)
+    z[:] = x
+    log_path = str(tmpdir.join("tasks.jsonl"))
+    with InstrumentedExecutor(
+        concurrent.futures.ThreadPoolExecutor(max_workers=2), log_path
+    ) as executor:
+        xd = zappy.executor.from_zarr(executor, input_file)
+        (xd + 1).to_zarr(str(tmpdir.join("y.zarr")), (2, 5))
+        assert len(executor.records) == 5
+        for index, record in enumerate(executor.records):
+            assert record["job"] == 0
+            assert record["task"] == index
+            assert record["submitted"] <= record["started"] <= record["finished"]
+            assert record["bytes_read"] == 2 * 5 * 8
+            assert record["bytes_written"] == 2 * 5 * 8
+            assert record["exception"] is None
+
+        with pytest.raises(ValueError):
+            list(executor.map(fail_on_three, range(5)))
+        assert [record["exception"] for record in executor.records] == [
+            None,
+            None,
+            None,
+            "ValueError('3')",
+            None,
+        ]
+        assert executor.records[0]["node"] == "fail_on_three"
+        assert executor.records[0]["result_bytes"] > 0
+
+    with open(log_path) as file:
+        records = [json.loads(line) for line in file]
+    assert len(records) == 10
+    assert [record["job"] for record in records] == [0] * 5 + [1] * 5
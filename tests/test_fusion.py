@@ -0,0 +1,143 @@
+import concurrent.futures
+import numpy as np
+import pytest
+import zappy.executor
+import zappy.executor.fusion
+
+from numpy.testing import assert_allclose, assert_array_equal
+from zappy.executor.dag import DAG
+from zappy.executor.fusion import ElementwiseKernel, fuse
+
+
+@pytest.fixture(params=[True, False])
+def use_numexpr(request, monkeypatch):
+    if request.param:
+        pytest.importorskip("numexpr")
+    else:
+        monkeypatch.setattr(zappy.executor.fusion, "numexpr", None)
+    return request.param
+
+
+@pytest.fixture()
+def small_tiles(monkeypatch):
+    # force several tiles per chunk
+    monkeypatch.setattr(zappy.executor.fusion, "TILE_BYTES", 16)
+
+
+def test_fuse_chain(use_numexpr, small_tiles):
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([np.arange(12.0).reshape(4, 3)])
+    kernel, inputs = fuse(np.true_divide, [input, 2.0])
+    x = dag.transform(kernel, inputs)
+    kernel, inputs = fuse(np.add, [x, 1])
+    x = dag.transform(kernel, inputs)
+    kernel, inputs = fuse(np.log1p, [x])
+    assert isinstance(kernel, ElementwiseKernel)
+    assert kernel.num_ops == 3
+    assert inputs == [input]
+    chunk = np.arange(12.0).reshape(4, 3)
+    assert_allclose(kernel(chunk), np.log1p(chunk / 2.0 + 1))
+
+
+def test_fuse_broadcast_row_and_column(use_numexpr, small_tiles):
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([np.arange(12.0).reshape(4, 3)])
+    column = dag.add_input([np.arange(4.0).reshape(4, 1)])
+    row = np.array([1.0, 2.0, 3.0])
+    kernel, inputs = fuse(np.multiply, [input, row])
+    x = dag.transform(kernel, inputs)
+    kernel, inputs = fuse(np.subtract, [x, column])
+    assert inputs == [input, column]
+    chunk = np.arange(12.0).reshape(4, 3)
+    col = np.arange(4.0).reshape(4, 1)
+    assert_allclose(kernel(chunk, col), chunk * row - col)
+
+
+def test_fuse_shared_subexpression_evaluated_once(small_tiles, monkeypatch):
+    monkeypatch.setattr(zappy.executor.fusion, "numexpr", None)
+    calls = []
+
+    def counting_log1p(x):
+        calls.append(len(x))
+        return np.log1p(x)
+
+    counting_log1p.__name__ = "counting_log1p"
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([np.ones((1, 3))])
+    kernel, inputs = fuse(counting_log1p, [input])
+    y = dag.transform(kernel, inputs)
+    kernel, inputs = fuse(np.multiply, [y, y])
+    yy = dag.transform(kernel, inputs)
+    kernel, inputs = fuse(np.add, [yy, y])
+    assert inputs == [input]
+    chunk = np.ones((1, 3))
+    assert_allclose(kernel(chunk), np.log1p(chunk) ** 2 + np.log1p(chunk))
+    assert calls == [1]
+
+
+def test_fuse_dtypes(use_numexpr, small_tiles):
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([np.arange(6).reshape(3, 2)])
+    kernel, inputs = fuse(np.greater, [input, 2])
+    chunk = np.arange(6).reshape(3, 2)
+    assert_array_equal(kernel(chunk), chunk > 2)
+    assert kernel(chunk).dtype == bool
+    kernel, inputs = fuse(np.true_divide, [input, 2])
+    assert_array_equal(kernel(chunk), chunk / 2)
+
+
+def test_fuse_max_ops():
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    x = dag.add_input([np.zeros((2, 2))])
+    for _ in range(zappy.executor.fusion.MAX_FUSED_OPS + 1):
+        kernel, inputs = fuse(np.negative, [x])
+        x = dag.transform(kernel, inputs)
+    assert kernel.num_ops == 1
+
+
+def test_executor_array_chain_is_one_transform():
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        x = np.arange(15.0).reshape(5, 3)
+        xd = zappy.executor.from_ndarray(executor, x, (2, 3))
+        xd = np.log1p(xd / 2 + 1) * 2
+        assert isinstance(xd.input.func, ElementwiseKernel)
+        assert xd.input.func.num_ops == 4
+        assert_allclose(np.asarray(xd), np.log1p(x / 2 + 1) * 2)
+
+
+def test_kernel_writes_into_out(use_numexpr, small_tiles):
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([np.zeros((4, 3))])
+    kernel, _ = fuse(np.multiply, [input, 2.0])
+    chunk = np.arange(12.0).reshape(4, 3)
+    result = kernel(chunk, out=chunk)
+    assert result is chunk
+    assert_allclose(result, np.arange(12.0).reshape(4, 3) * 2)
+
+    # a bool result can't be written into a float buffer
+    kernel, _ = fuse(np.greater, [input, 2.0])
+    chunk = np.arange(12.0).reshape(4, 3)
+    result = kernel(chunk, out=chunk)
+    assert result is not chunk
+    assert_array_equal(result, np.arange(12.0).reshape(4, 3) > 2)
+
+
+def test_kernel_does_not_write_into_overlapping_out(use_numexpr, small_tiles):
+    dag = DAG(concurrent.futures.ThreadPoolExecutor())
+    input = dag.add_input([np.zeros((4, 3))])
+    kernel, _ = fuse(np.add, [input, input])
+    chunk = np.arange(12.0).reshape(4, 3)
+    expected = chunk + chunk[::-1]
+    # the second argument is a view of out, so writing into out would change it before it is read
+    result = kernel(chunk, chunk[::-1], out=chunk)
+    assert result is not chunk
+    assert_allclose(result, expected)
+
+
+def test_executor_array_add_reversed_view(use_numexpr):
+    x = np.arange(300.0).reshape(30, 10)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        xd = zappy.executor.from_ndarray(executor, x, (10, 10))
+        y = (xd + 1).astype(np.float64)
+        z = y + y[:, ::-1]
+        assert_allclose(np.asarray(z), (x + 1) + (x + 1)[:, ::-1])
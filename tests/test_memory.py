@@ -0,0 +1,68 @@
+import concurrent.futures
+import numpy as np
+import pytest
+import zappy.executor
+import zarr
+
+from numpy.testing import assert_allclose
+from zappy.executor.dag import DAG, Program
+from zappy.executor.memory import fit_row_chunks, live_chunks
+
+
+def test_live_chunks():
+    dag = DAG(None)
+    input = dag.add_input([(2, 5)])
+    x = dag.transform(np.zeros, [input])
+    y = dag.transform(np.negative, [x])
+    z = dag.transform(np.exp, [y])
+    # x is released once y is computed
+    assert live_chunks(Program([z])) == 2 + 1
+    w = dag.transform(np.add, [x, z])
+    assert live_chunks(Program([w])) == 3 + 1
+
+
+def test_fit_row_chunks():
+    assert fit_row_chunks((100, 10), float, 8000, 2) == 50
+    assert fit_row_chunks((100, 10), float, 8000, 2, multiple_of=20) == 40
+    assert fit_row_chunks((100, 10), float, 10 ** 6, 2, multiple_of=20) == 100
+    with pytest.raises(ValueError):
+        fit_row_chunks((100, 10), float, 1000, 2, multiple_of=20)
+
+
+def test_max_task_memory(tmpdir):
+    x = np.arange(1000.0).reshape(100, 10)
+    input_file = str(tmpdir.join("x.zarr"))
+    z = zarr.open(input_file, mode="w", shape=x.shape, chunks=(10, 10), dtype=x.dtype)
+    z[:] = x
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        # chunks are sized before the operations are known, for task_memory_live_chunks (4) chunks: 25 rows of
+        # 80 bytes; the estimate for the ones task itself counts 2, the chunk it creates and its serialized copy
+        ones = zappy.executor.ones(executor, (100, 10), max_task_memory=8000)
+        assert ones.chunks == (25, 10)
+        assert ones.estimate_task_memory() == 25 * 80 * 2
+        assert_allclose(np.asarray(ones), np.ones((100, 10)))
+
+        # whole zarr chunks are read
+        xd = zappy.executor.from_zarr(executor, input_file, max_task_memory=8000)
+        assert xd.chunks == (20, 10)
+        assert_allclose(np.asarray(xd + 1), x + 1)
+
+        # 33 rows of 80 bytes, for 3 live chunks when repartitioning
+        output_file = str(tmpdir.join("y.zarr"))
+        xd.to_zarr(output_file)
+        assert zarr.open(output_file, mode="r").chunks == (33, 10)
+        assert_allclose(zarr.open(output_file, mode="r")[:], x)
+
+        with pytest.raises(ValueError):
+            xd.to_zarr(str(tmpdir.join("z.zarr")), (50, 10))
+
+
+def test_default_chunks():
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        # without a memory budget, the whole array is one chunk
+        zeros = zappy.executor.zeros(executor, (10, 5))
+        assert zeros.chunks == (10, 5)
+        assert_allclose(np.asarray(zeros), np.zeros((10, 5)))
+        ones = zappy.executor.ones(executor, (10, 5), dtype=int)
+        assert ones.chunks == (10, 5)
+        assert_allclose(np.asarray(ones), np.ones((10, 5)))
@@ -0,0 +1,42 @@
+import concurrent.futures
+import io
+import numpy as np
+import zappy
+import zappy.direct
+import zappy.executor
+
+from numpy.testing import assert_allclose
+
+
+def test_profile_direct():
+    x = np.arange(50.0).reshape(10, 5)
+    xd = zappy.direct.from_ndarray(x, (2, 5))
+    column = zappy.direct.from_ndarray(x[:, 0:1].copy(), (2, 1))
+    report = io.StringIO()
+    with zappy.profile(report) as profiler:
+        y = xd - column  # materializes the column on the driver
+        assert_allclose(np.asarray(y), x - x[:, 0:1])
+        np.sum(xd, axis=0)
+    assert profiler.stats[("subtract",)][0] == 1
+    assert profiler.stats[("subtract", "asndarray")][2] == 10 * 8
+    assert profiler.stats[("asndarray",)][2] == 50 * 8
+    assert profiler.stats[("sum",)][0] == 1
+    lines = report.getvalue().splitlines()
+    assert lines[0].split() == ["calls", "seconds", "driver", "bytes", "operation"]
+    assert len(lines) == 1 + len(profiler.stats)
+
+    # nothing is recorded outside the block
+    np.sum(xd, axis=0)
+    assert profiler.stats[("sum",)][0] == 1
+
+
+def test_profile_executor():
+    x = np.arange(50.0).reshape(10, 5)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        xd = zappy.executor.from_ndarray(executor, x, (2, 5))
+        with zappy.profile(io.StringIO()) as profiler:
+            assert_allclose(np.asarray(xd - np.mean(xd)), x - np.mean(x))
+    # the mean is computed on the driver when the subtraction that uses it is materialized
+    assert ("mean",) in profiler.stats
+    assert ("asndarray", "reduce") in profiler.stats
+    assert profiler.stats[("asndarray",)][2] == 50 * 8
@@ -1,12 +1,10 @@
 import concurrent.futures
-import logging
 import numpy as np
 import pytest
 import zappy.executor
 import zappy.direct
 import zappy.spark
 
-from pyspark.sql import SparkSession
 
 TESTS = [0, 1, 2]
 
@@ -16,18 +14,6 @@ class TestZappyArray:
     def x(self):
         return np.array([[a] for a in range(12)])
 
-    @pytest.fixture(scope="module")
-    def sc(self):
-        logger = logging.getLogger("py4j")
-        logger.setLevel(logging.WARN)
-        spark = (
-            SparkSession.builder.master("local[2]")
-            .appName("my-local-testing-pyspark-context")
-            .getOrCreate()
-        )
-        yield spark.sparkContext
-        spark.stop()
-
     @pytest.fixture(params=TESTS)
     def xd(self, sc, x, request):
         if request.param == 0:
@@ -0,0 +1,58 @@
+import concurrent.futures
+import numpy as np
+import pytest
+
+from numpy.testing import assert_array_equal
+from zappy import serialization
+from zappy.executor import SerializingExecutor
+
+
+def test_dumps_loads():
+    x = np.arange(12.0).reshape(4, 3)
+    value = (x, x[:, 0], np.asfortranarray(x), "label", 3, np.zeros((0, 3)))
+    data = serialization.dumps(value)
+    assert isinstance(data, bytes)
+    result = serialization.loads(data)
+    assert len(result) == len(value)
+    for expected, actual in zip(value, result):
+        if isinstance(expected, np.ndarray):
+            assert_array_equal(actual, expected)
+            assert actual.dtype == expected.dtype
+        else:
+            assert actual == expected
+
+
+@pytest.mark.skipif(not serialization.OUT_OF_BAND, reason="needs pickle protocol 5")
+def test_out_of_band():
+    x = np.arange(1000.0)
+    frames = serialization.serialize(x)
+    assert len(frames) == 2
+    assert len(frames[0]) < 1000  # the data is not in the pickle stream
+    # deserialized arrays are views of the serialized bytes
+    data = serialization.dumps(x)
+    y = serialization.loads(data)
+    assert not y.flags.owndata
+    assert not y.flags.writeable
+    assert_array_equal(y, x)
+
+
+def add(x, y):
+    return x + y
+
+
+def test_serializing_executor():
+    with SerializingExecutor(
+        concurrent.futures.ProcessPoolExecutor(max_workers=2)
+    ) as executor:
+        results = list(executor.map(add, [np.ones(3), np.zeros(2)], [1, 2]))
+    assert_array_equal(results[0], np.ones(3) + 1)
+    assert_array_equal(results[1], np.zeros(2) + 2)
+
+
+def test_spark_chunk_serializer(sc):
+    from zappy.spark.serializer import ChunkSerializer
+
+    chunks = [np.arange(6.0).reshape(2, 3), np.arange(3.0).reshape(1, 3)]
+    rdd = sc.parallelize(chunks, 2)._reserialize(ChunkSerializer())
+    results = rdd.map(lambda x: x + 1).collect()
+    assert_array_equal(np.concatenate(results), np.concatenate(chunks) + 1)
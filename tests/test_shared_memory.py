@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import sys
+import zappy.executor
+
+from numpy.testing import assert_allclose
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 8), reason="shared memory needs Python 3.8 or later"
+)
+
+
+def owns_data(x):
+    return x.flags.owndata
+
+
+def test_shared_memory_executor():
+    with zappy.executor.SharedMemoryExecutor(max_workers=2) as executor:
+        # arrays are passed to workers as views of shared memory, not as pickled copies
+        assert list(executor.map(owns_data, [np.ones(10), np.ones(5)])) == [
+            False,
+            False,
+        ]
+        results = list(executor.map(lambda x, y: (x + y, x.sum()), [np.ones(3)], [2]))
+        assert_allclose(results[0][0], np.ones(3) + 2)
+        assert results[0][1] == 3
+        assert executor.submit(lambda x: x * 2, np.arange(4)).result().tolist() == [
+            0,
+            2,
+            4,
+            6,
+        ]
+
+
+def test_shared_memory_executor_exception():
+    with zappy.executor.SharedMemoryExecutor(max_workers=2) as executor:
+        with pytest.raises(ZeroDivisionError):
+            list(executor.map(lambda x: int(x[0]) // 0, [np.arange(1, 3)]))
+
+
+def test_shared_memory_executor_array():
+    x = np.arange(50.0).reshape(10, 5)
+    with zappy.executor.SharedMemoryExecutor(max_workers=2) as executor:
+        xd = zappy.executor.from_ndarray(executor, x, (3, 5))
+        assert_allclose(np.asarray(xd + 1), x + 1)
+        assert_allclose(np.asarray(np.sum(xd, axis=0)), np.sum(x, axis=0))
+        assert_allclose(np.asarray(np.sum(xd, axis=1)), np.sum(x, axis=1))
+        assert np.mean(xd) == pytest.approx(np.mean(x))
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+import zappy.executor
+
+from numpy.testing import assert_allclose
+from zappy.executor import SimulatedOutOfMemoryError, SimulatedServerlessExecutor
+
+
+def add_one(x):
+    return x + 1
+
+
+def allocate(n):
+    return np.ones(n).sum()
+
+
+def test_simulated_serverless_executor():
+    executor = SimulatedServerlessExecutor(
+        max_concurrency=2, cold_start=1.0, invocation_overhead=0.1, compute_scale=0.0
+    )
+    assert list(executor.map(add_one, range(4))) == [1, 2, 3, 4]
+    run_statuses = [invocation.run_status for invocation in executor.invocations]
+    # the first two tasks start new containers, and the others wait for them (tasks take no simulated time, so the
+    # third task's container, started first, is also the first free one for the fourth)
+    assert [status["cold_start"] for status in run_statuses] == [
+        True,
+        True,
+        False,
+        False,
+    ]
+    assert [status["setup_time"] for status in run_statuses] == [1.0, 1.0, 0.0, 0.0]
+    assert run_statuses[0]["start_time"] == pytest.approx(0.1)
+    assert run_statuses[1]["start_time"] == pytest.approx(0.2)
+    assert run_statuses[2]["start_time"] == pytest.approx(run_statuses[0]["end_time"])
+    assert run_statuses[3]["start_time"] == pytest.approx(run_statuses[2]["end_time"])
+    # the driver's clock is at the last download of a result
+    assert executor.clock == pytest.approx(
+        max(status["download_output_timestamp"] for status in run_statuses)
+    )
+
+    # the fields used by pywren-scripts/util.py are recorded
+    invoke_status = executor.invocations[0].invoke_status
+    for field in [
+        "host_submit_time",
+        "data_upload_time",
+        "data_upload_timestamp",
+        "func_upload_timestamp",
+    ]:
+        assert field in invoke_status
+    for field in ["start_time", "setup_time", "end_time", "download_output_timestamp"]:
+        assert field in run_statuses[0]
+
+
+def test_simulated_serverless_executor_warm_timeout():
+    executor = SimulatedServerlessExecutor(cold_start=1.0, warm_timeout=10.0)
+    assert executor.submit(add_one, 1).result() == 2
+    assert executor.submit(add_one, 2).result() == 3
+    executor.clock += 20  # the container is idle for too long
+    assert executor.submit(add_one, 3).result() == 4
+    cold_starts = [status.run_status["cold_start"] for status in executor.invocations]
+    assert cold_starts == [True, False, True]
+
+
+def test_simulated_serverless_executor_bandwidth():
+    executor = SimulatedServerlessExecutor(
+        invocation_overhead=0, upload_bandwidth=1e6, download_bandwidth=1e6
+    )
+    executor.submit(add_one, np.ones(10 ** 5)).result()
+    invocation = executor.invocations[0]
+    assert invocation.invoke_status["data_upload_time"] > 0.8  # 800KB at 1MB/s
+    run_status = invocation.run_status
+    assert run_status["download_output_timestamp"] - run_status["end_time"] > 0.8
+
+
+def test_simulated_serverless_executor_memory_limit():
+    executor = SimulatedServerlessExecutor(memory_limit=10 ** 6)
+    assert executor.submit(allocate, 1000).result() == 1000
+    with pytest.raises(SimulatedOutOfMemoryError):
+        executor.submit(allocate, 10 ** 6).result()
+    assert executor.invocations[1].run_status["peak_memory"] > 8 * 10 ** 6
+
+
+def test_simulated_serverless_executor_array():
+    x = np.arange(50.0).reshape(10, 5)
+    executor = SimulatedServerlessExecutor(max_concurrency=2)
+    xd = zappy.executor.from_ndarray(executor, x, (2, 5))
+    assert_allclose(np.asarray(xd + 1), x + 1)
+    assert_allclose(np.asarray(np.sum(xd, axis=0)), np.sum(x, axis=0))
+    assert len(executor.invocations) > 5
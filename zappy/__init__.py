@@ -0,0 +1,11 @@
+from zappy.profiler import profile
+
+
+def compute(*values):
+    """
+    Compute several results of the executor engine together; see zappy.executor.array.compute. The executor
+    engine is imported on first use, so that importing zappy doesn't import it.
+    """
+    from zappy.executor.array import compute as executor_compute
+
+    return executor_compute(*values)
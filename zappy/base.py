@@ -6,6 +6,7 @@ import zarr
 
 from functools import partial
 
+from zappy.profiler import profiled
 from zappy.zarr_util import (
     get_chunk_indices,
     read_zarr_chunk,
@@ -16,6 +17,20 @@ from zappy.zarr_util import (
 )
 
 
+class _AsType(object):
+    """Function to cast a chunk to a dtype. The chunk is returned as is if it is passed as the out buffer (so it
+    can be reused) and already has the dtype."""
+
+    reuses_buffers = True
+    owns_result = True
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+
+    def __call__(self, x, out=None):
+        return x.astype(self.dtype, copy=out is not x)
+
+
 class ZappyArray(np.lib.mixins.NDArrayOperatorsMixin):
     def __init__(self, shape, chunks, dtype, partition_row_counts=None):
         self.shape = shape
@@ -79,6 +94,7 @@ class ZappyArray(np.lib.mixins.NDArrayOperatorsMixin):
             self._compute(), self.partition_row_counts
         )
 
+    @profiled("asndarray")
     def __array__(self, dtype=None, **kwargs):
         # respond to np.asarray
         x = self.asndarray()
@@ -104,6 +120,7 @@ class ZappyArray(np.lib.mixins.NDArrayOperatorsMixin):
         else:
             return self._repartition_chunks(chunks)
 
+    @profiled("to_zarr")
     def to_zarr(self, zarr_file, chunks, ncopies=1):
         """
         Write an ZappyArray object to a Zarr file.
@@ -124,6 +141,7 @@ class ZappyArray(np.lib.mixins.NDArrayOperatorsMixin):
         repartitioned = self._repartition_if_necessary(chunks)
         repartitioned._write_zarr(zarr_file, chunks, write_chunk(zarr_file))
 
+    @profiled("to_zarr_gcs")
     def to_zarr_gcs(self, gcs_path, chunks, gcs_project, gcs_token="cloud", ncopies=1):
         """
         Write an ZappyArray object to a Zarr file on GCS.
@@ -160,51 +178,66 @@ class ZappyArray(np.lib.mixins.NDArrayOperatorsMixin):
 
     # Array conversion (https://docs.scipy.org/doc/numpy-1.14.0/reference/arrays.ndarray.html#array-methods)
 
+    @profiled("astype")
     def astype(self, dtype, copy=True):
         out = None if copy else self
         dtype = dtype if isinstance(dtype, np.dtype) else np.dtype(dtype)
-        return self._unary_ufunc(lambda x: x.astype(dtype), out=out, dtype=dtype)
+        return self._unary_ufunc(_AsType(dtype), out=out, dtype=dtype)
 
     def copy(self):
         return self._new()
 
     # Calculation methods (https://docs.scipy.org/doc/numpy-1.14.0/reference/arrays.ndarray.html#calculation)
 
+    @profiled("mean")
     def mean(self, axis, out=None, dtype=None, **kwargs):
         if axis == 1:
             return self._calc_func_axis_rowwise(np.mean, axis)
         return self._calc_mean(axis)
 
+    @profiled("max")
+    def max(self, axis, out=None, dtype=None, **kwargs):
+        if axis == 1:
+            return self._calc_func_axis_rowwise(np.amax, axis)
+        return self._calc_func_axis_distributive(np.amax, axis)
+
+    @profiled("argmax")
     def argmax(self, axis, out=None, dtype=None, **kwargs):
         if axis == 1:
             return self._calc_func_axis_rowwise(np.argmax, axis)
         return self._calc_func_axis_distributive(np.argmax, axis)
 
+    @profiled("min")
     def min(self, axis, out=None, dtype=None, **kwargs):
         if axis == 1:
             return self._calc_func_axis_rowwise(np.amin, axis)
         return self._calc_func_axis_distributive(np.amin, axis)
 
+    @profiled("argmin")
     def argmin(self, axis, out=None, dtype=None, **kwargs):
         if axis == 1:
             return self._calc_func_axis_rowwise(np.argmin, axis)
         return self._calc_func_axis_distributive(np.argmin, axis)
 
+    @profiled("sum")
     def sum(self, axis, out=None, dtype=None, **kwargs):
         if axis == 1:
             return self._calc_func_axis_rowwise(np.sum, axis)
         return self._calc_func_axis_distributive(np.sum, axis)
 
+    @profiled("prod")
     def prod(self, axis, out=None, dtype=None, **kwargs):
         if axis == 1:
             return self._calc_func_axis_rowwise(np.prod, axis)
         return self._calc_func_axis_distributive(np.prod, axis)
 
+    @profiled("all")
     def all(self, axis, out=None, dtype=None, **kwargs):
         if axis == 1:
             return self._calc_func_axis_rowwise(np.all, axis)
         return self._calc_func_axis_distributive(np.all, axis)
 
+    @profiled("any")
     def any(self, axis, out=None, dtype=None, **kwargs):
         if axis == 1:
             return self._calc_func_axis_rowwise(np.any, axis)
@@ -230,6 +263,7 @@ class ZappyArray(np.lib.mixins.NDArrayOperatorsMixin):
 
     # Distributed ufunc internal implementation
 
+    @profiled(lambda self, ufunc, *args, **kwargs: ufunc.__name__)
     def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
         if method == "__call__":
             # TODO: handle dtype generically
@@ -288,6 +322,7 @@ class ZappyArray(np.lib.mixins.NDArrayOperatorsMixin):
 
     # Slicing implementation
 
+    @profiled("getitem")
     def __getitem__(self, item):
         all_indices = slice(None, None, None)
         if isinstance(item, numbers.Number):
@@ -376,6 +411,17 @@ class ZappyArray(np.lib.mixins.NDArrayOperatorsMixin):
             return [len(s) for s in partition_row_subsets]
         return NotImplemented
 
+    @staticmethod
+    def _ufunc_result_dtype(func, *operands):
+        """Return the dtype of the result of applying a ufunc to arrays or scalars of the operands' types."""
+        with np.errstate(all="ignore"):
+            return func(
+                *[
+                    np.ones(1 if np.ndim(op) > 0 else (), dtype=np.asarray(op).dtype)
+                    for op in operands
+                ]
+            ).dtype
+
     @staticmethod
     def _materialize_index(index):
         """Materialize index as an ndarray, or leave as a slice."""
@@ -25,16 +25,37 @@ def ones(shape, chunks, dtype=float):
 class DirectZappyArray(ZappyArray):
     """A numpy.ndarray backed by chunked storage"""
 
-    def __init__(self, local_rows, shape, chunks, dtype, partition_row_counts=None):
+    def __init__(
+        self,
+        local_rows,
+        shape,
+        chunks,
+        dtype,
+        partition_row_counts=None,
+        owns_chunks=False,
+    ):
         ZappyArray.__init__(self, shape, chunks, dtype, partition_row_counts)
         self.local_rows = local_rows
+        # whether the chunks were allocated for this array, and are not shared with
+        # (or views of) other arrays, so they can be overwritten by in-place operations
+        self.owns_chunks = owns_chunks
+
+    def _new(self, **kwargs):
+        if not kwargs.get("owns_chunks", False):
+            # the new object may share the chunks, or views of them (such as a slice), so
+            # they can no longer be overwritten by in-place operations on this array
+            self.owns_chunks = False
+        kwargs.setdefault("owns_chunks", False)
+        return ZappyArray._new(self, **kwargs)
 
     # methods to convert to/from regular ndarray - mainly for testing
     @classmethod
     def from_ndarray(cls, arr, chunks):
         func, chunk_indices = ZappyArray._read_chunks(arr, chunks)
         local_rows = [func(i) for i in chunk_indices]
-        return cls(local_rows, arr.shape, chunks, arr.dtype)
+        # chunks read from an ndarray are views of it, but reads from zarr are copies
+        owns_chunks = not isinstance(arr, np.ndarray)
+        return cls(local_rows, arr.shape, chunks, arr.dtype, owns_chunks=owns_chunks)
 
     @classmethod
     def from_zarr(cls, zarr_file):
@@ -49,14 +70,14 @@ class DirectZappyArray(ZappyArray):
         local_rows = [
             np.zeros(chunk, dtype=dtype) for chunk in get_chunk_sizes(shape, chunks)
         ]
-        return cls(local_rows, shape, chunks, dtype)
+        return cls(local_rows, shape, chunks, dtype, owns_chunks=True)
 
     @classmethod
     def ones(cls, shape, chunks, dtype=float):
         local_rows = [
             np.ones(chunk, dtype=dtype) for chunk in get_chunk_sizes(shape, chunks)
         ]
-        return cls(local_rows, shape, chunks, dtype)
+        return cls(local_rows, shape, chunks, dtype, owns_chunks=True)
 
     def _compute(self):
         return self.local_rows
@@ -108,6 +129,8 @@ class DirectZappyArray(ZappyArray):
         )
 
     def _calc_func_axis_distributive(self, func, axis):
+        if func in (np.argmin, np.argmax):
+            return self._calc_arg_func_axis(func, axis)
         per_chunk_result = [func(x, axis=axis) for x in self.local_rows]
         result = func(per_chunk_result, axis=axis)
         if axis is None:
@@ -122,39 +145,87 @@ class DirectZappyArray(ZappyArray):
             )
         return NotImplemented
 
+    def _calc_arg_func_axis(self, func, axis):
+        # per-chunk indices are relative to the chunk, so find the chunk with the extreme value, and add its offset
+        value_func = np.amin if func is np.argmin else np.amax
+        local_rows = [x for x in self.local_rows if x.shape[0] > 0]
+        row_offsets = np.cumsum([0] + [x.shape[0] for x in local_rows][:-1])
+        values = np.array([value_func(x, axis=axis) for x in local_rows])
+        indices = np.array([func(x, axis=axis) for x in local_rows])
+        best = func(values, axis=0)  # the first chunk with the extreme value wins ties
+        if axis is None:
+            row_size = int(np.prod(self.shape[1:]))
+            return indices[best] + row_offsets[best] * row_size
+        elif axis == 0:  # column-wise
+            columns = np.arange(values.shape[1])
+            result = indices[best, columns] + row_offsets[best]
+            return self._new(
+                local_rows=[result],
+                shape=result.shape,
+                chunks=result.shape,
+                partition_row_counts=result.shape,
+            )
+        return NotImplemented
+
     # Distributed ufunc internal implementation
 
+    def _apply_elementwise(self, func, others=None, out=None, dtype=None):
+        """Apply func to each chunk, and the corresponding element of others for a binary function.
+
+        If this array is the out buffer and owns its chunks, then the results are written into the chunks (when
+        the result dtype allows) rather than into newly allocated arrays.
+        """
+        args = [
+            (x,) if others is None else (x, y)
+            for x, y in zip(self.local_rows, others or self.local_rows)
+        ]
+        if self._can_reuse_chunks(func, args, out):
+            new_local_rows = [func(*a, out=a[0]) for a in args]
+        else:
+            new_local_rows = [func(*a) for a in args]
+        owns_chunks = isinstance(func, np.ufunc) or getattr(func, "owns_result", False)
+        return self._new(
+            local_rows=new_local_rows, out=out, dtype=dtype, owns_chunks=owns_chunks
+        )
+
+    def _can_reuse_chunks(self, func, args, out):
+        if isinstance(out, tuple) and len(out) > 0:
+            out = out[0]
+        if out is not self or not self.owns_chunks:
+            return False
+        if isinstance(func, np.ufunc):
+            return all(
+                ZappyArray._ufunc_result_dtype(func, *a) == a[0].dtype for a in args
+            )
+        return getattr(func, "reuses_buffers", False)
+
     def _unary_ufunc(self, func, out=None, dtype=None):
-        new_local_rows = [func(x) for x in self.local_rows]
-        return self._new(local_rows=new_local_rows, out=out, dtype=dtype)
+        return self._apply_elementwise(func, out=out, dtype=dtype)
 
     def _binary_ufunc_self(self, func, out=None, dtype=None):
-        new_local_rows = [func(x, x) for x in self.local_rows]
-        return self._new(local_rows=new_local_rows, out=out, dtype=dtype)
+        return self._apply_elementwise(func, self.local_rows, out=out, dtype=dtype)
 
     def _binary_ufunc_broadcast_single_row_or_value(
         self, func, other, out=None, dtype=None
     ):
         other = np.asarray(other)  # materialize
-        new_local_rows = [func(x, other) for x in self.local_rows]
-        return self._new(local_rows=new_local_rows, out=out, dtype=dtype)
+        others = [other] * len(self.local_rows)
+        return self._apply_elementwise(func, others, out=out, dtype=dtype)
 
     def _binary_ufunc_broadcast_single_column(self, func, other, out=None, dtype=None):
         other = np.asarray(other)  # materialize
         partition_row_subsets = ZappyArray._copartition(
             other, self.partition_row_counts
         )
-        new_local_rows = [
-            func(p[0], p[1]) for p in zip(self.local_rows, partition_row_subsets)
-        ]
-        return self._new(local_rows=new_local_rows, out=out, dtype=dtype)
+        return self._apply_elementwise(
+            func, partition_row_subsets, out=out, dtype=dtype
+        )
 
     def _binary_ufunc_same_shape(self, func, other, out=None, dtype=None):
         if self.partition_row_counts == other.partition_row_counts:
-            new_local_rows = [
-                func(p[0], p[1]) for p in zip(self.local_rows, other.local_rows)
-            ]
-            return self._new(local_rows=new_local_rows, out=out, dtype=dtype)
+            return self._apply_elementwise(
+                func, other.local_rows, out=out, dtype=dtype
+            )
         return NotImplemented
 
     # Slicing
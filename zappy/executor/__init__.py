@@ -4,5 +4,25 @@ from zappy.executor.array import (
     ones,
     zeros,
     asndarrays,
+    compute,
     PywrenExecutor,
 )
+from zappy.executor.concurrency import (
+    AdaptiveConcurrencyExecutor,
+    AIMDPolicy,
+    FixedConcurrencyPolicy,
+    SimulatedObjectStore,
+    ThrottlingError,
+)
+from zappy.executor.executors import (
+    BatchingExecutor,
+    InstrumentedExecutor,
+    RetryingExecutor,
+    SerializingExecutor,
+    SpeculativeExecutor,
+)
+from zappy.executor.shared_memory import SharedMemoryExecutor
+from zappy.executor.simulated import (
+    SimulatedOutOfMemoryError,
+    SimulatedServerlessExecutor,
+)
@@ -0,0 +1,39 @@
+import asyncio
+
+from functools import partial
+
+from zappy.executor.array import ExecutorZappyArray, compute as _compute
+
+# asyncio versions of the actions on executor arrays (Python 3 only, so this module is not imported by the
+# zappy.executor package). Each action runs its jobs from a thread of the event loop's default executor, so the
+# event loop, and jobs started by other coroutines, carry on while it runs: several independent jobs can be in
+# flight on the same executor at once.
+
+
+def _in_thread(func, *args):
+    return asyncio.get_event_loop().run_in_executor(None, partial(func, *args))
+
+
+async def asndarray(arr):
+    """Compute an ExecutorZappyArray and return it as an ndarray."""
+    return await _in_thread(arr.asndarray)
+
+
+async def asndarrays(arrays):
+    """An asyncio version of zappy.executor.asndarrays."""
+    return await _in_thread(ExecutorZappyArray.asndarrays, arrays)
+
+
+async def to_zarr(arr, zarr_file, chunks=None, ncopies=1):
+    """Write an ExecutorZappyArray to a Zarr file."""
+    return await _in_thread(arr.to_zarr, zarr_file, chunks, ncopies)
+
+
+async def result(reduction):
+    """Return the result of a lazy reduction, computing it if necessary."""
+    return await _in_thread(reduction.result)
+
+
+async def compute(*values):
+    """An asyncio version of zappy.compute."""
+    return await _in_thread(_compute, *values)
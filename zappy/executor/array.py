@@ -1,6 +1,9 @@
 import builtins
+import collections
 import concurrent.futures
 import datetime
+import hashlib
+import operator
 import os
 import pickle
 import uuid
@@ -9,11 +12,29 @@ import numpy as np
 import zarr
 
 from zappy.base import *  # include everything in zappy.base and hence base numpy
-from zappy.executor.dag import DAG
+from zappy.executor.cache import chunk_cache, operand_cache
+from zappy.executor.dag import DAG, Deferred, Input, LazyVal, Program, compute_merged
+from zappy.executor.executors import speculative_map
+from zappy.executor.fusion import fuse
+from zappy.executor.memory import estimate_task_memory, fit_row_chunks, live_chunks
+from zappy.executor.reduction import (
+    ArgReduction,
+    DistributiveReduction,
+    MeanReduction,
+    tree_reduce,
+    write_partial,
+)
+from zappy.profiler import profiled
 from zappy.zarr_util import (
     calculate_partition_boundaries,
+    delete_values,
     extract_partial_chunks,
     get_chunk_sizes,
+    load_value,
+    open_store,
+    store_key,
+    store_location,
+    store_value,
 )
 
 
@@ -21,27 +42,349 @@ def from_ndarray(executor, arr, chunks, intermediate_store=None):
     return ExecutorZappyArray.from_ndarray(executor, arr, chunks, intermediate_store)
 
 
-def from_zarr(executor, zarr_file, intermediate_store=None):
-    return ExecutorZappyArray.from_zarr(executor, zarr_file, intermediate_store)
+def from_zarr(executor, zarr_file, intermediate_store=None, max_task_memory=None):
+    return ExecutorZappyArray.from_zarr(
+        executor, zarr_file, intermediate_store, max_task_memory
+    )
 
 
-def zeros(executor, shape, chunks, dtype=float, intermediate_store=None):
-    return ExecutorZappyArray.zeros(executor, shape, chunks, dtype, intermediate_store)
+def zeros(
+    executor,
+    shape,
+    chunks=None,
+    dtype=float,
+    intermediate_store=None,
+    max_task_memory=None,
+):
+    return ExecutorZappyArray.zeros(
+        executor, shape, chunks, dtype, intermediate_store, max_task_memory
+    )
 
 
-def ones(executor, shape, chunks, dtype=float, intermediate_store=None):
-    return ExecutorZappyArray.ones(executor, shape, chunks, dtype, intermediate_store)
+def ones(
+    executor,
+    shape,
+    chunks=None,
+    dtype=float,
+    intermediate_store=None,
+    max_task_memory=None,
+):
+    return ExecutorZappyArray.ones(
+        executor, shape, chunks, dtype, intermediate_store, max_task_memory
+    )
 
 
 def asndarrays(arrays):
     return ExecutorZappyArray.asndarrays(arrays)
 
 
+def _pending_reductions(arr):
+    """Return the reductions that computing the array depends on and that have not been computed yet."""
+    return [
+        value
+        for value in arr.dag.deferred_inputs([arr.input])
+        if isinstance(value, LazyReduction) and not value.computed
+    ]
+
+
+@profiled("compute")
+def compute(*values):
+    """
+    Compute several results together. Each value is an ExecutorZappyArray, or the lazy result of a reduction (such
+    as a.sum(axis=0) or a.mean()). Reductions, and arrays, that are computed from the same DAG are evaluated in a
+    single executor job, so their input is only read once.
+
+    Values may depend on reductions that have not been computed, such as x - x.mean(axis=0). These are run as a
+    plan of stages: each stage is a job for the reductions whose own inputs are ready, and the reduced values are
+    passed to the tasks of the next stage as side inputs.
+    :return: a tuple with the result for each value: an ndarray for an array, or the reduction result
+    """
+    arrays = [value for value in values if isinstance(value, ExecutorZappyArray)]
+    pending = []
+
+    def add_pending(reduction):
+        if not reduction.computed and not any(reduction is r for r in pending):
+            pending.append(reduction)
+            for dependency in _pending_reductions(reduction.array):
+                add_pending(dependency)
+
+    for value in values:
+        if isinstance(value, LazyReduction):
+            add_pending(value)
+    for arr in arrays:
+        for reduction in _pending_reductions(arr):
+            add_pending(reduction)
+
+    results = {}
+    while len(pending) > 0:
+        # the reductions whose inputs don't depend on a pending reduction can run in this stage
+        stage = [r for r in pending if len(_pending_reductions(r.array)) == 0]
+        assert len(stage) > 0, "Reductions depend on each other"
+        pending = [r for r in pending if not any(r is s for s in stage)]
+        jobs = collections.OrderedDict()
+        for reduction in stage:
+            dag = reduction.array.dag
+            jobs.setdefault(id(dag), (dag, [], []))[1].append(reduction)
+        for arr in arrays:
+            if (
+                id(arr.dag) in jobs
+                and id(arr) not in results
+                and len(_pending_reductions(arr)) == 0
+            ):
+                jobs[id(arr.dag)][2].append(arr)
+
+        for dag, job_reductions, job_arrays in jobs.values():
+            outputs = [reduction._output() for reduction in job_reductions]
+            result_outputs = [arr._result_output() for arr in job_arrays]
+            outputs.extend([output for output, _ in result_outputs])
+            output_chunks = list(dag.compute_multiple(outputs))
+            for reduction, partials in zip(job_reductions, output_chunks):
+                reduction._finish(partials)
+            for arr, (_, prefix), chunks in zip(
+                job_arrays, result_outputs, output_chunks[len(job_reductions) :]
+            ):
+                results[id(arr)] = arr._assemble_chunks(
+                    arr._fetch_results(chunks, prefix)
+                )
+    remaining = [arr for arr in arrays if id(arr) not in results]
+    for arr, ndarray in zip(remaining, ExecutorZappyArray.asndarrays(remaining)):
+        results[id(arr)] = ndarray
+
+    def result(value):
+        if isinstance(value, ExecutorZappyArray):
+            return results[id(value)]
+        elif isinstance(value, LazyReduction):
+            return value.result()
+        elif isinstance(value, ZappyArray):
+            return np.asarray(value)
+        return value
+
+    return tuple(result(value) for value in values)
+
+
+class LazyReduction(Deferred, np.lib.mixins.NDArrayOperatorsMixin):
+    """
+    The result of a reduction over an ExecutorZappyArray, which is computed the first time it is needed (or by
+    compute(), together with other results). It can be used like the result (a NumPy scalar) in arithmetic,
+    comparisons, conversions, formatting and hashing, and has its dtype, shape and item(); but it is not an
+    instance of float or np.generic, so use result() (or float()) where that is checked.
+    """
+
+    def __init__(self, array, reduction):
+        self.array = array
+        self.reduction = reduction
+        self.computed = False
+        self.value = None
+        self._prefix = None
+
+    def result(self):
+        if not self.computed:
+            self._compute()
+        return self.value
+
+    def result_async(self):
+        """An asyncio version of result (see zappy.executor.aio)."""
+        from zappy.executor import aio
+
+        return aio.result(self)
+
+    @profiled("reduce")
+    def _compute(self):
+        self._finish(self.array.dag.compute(self._output()))
+
+    def _is_tree_reduce(self):
+        fan_in = self.array.tree_reduce_fan_in
+        return fan_in is not None and len(self.array.partition_row_counts) > fan_in
+
+    def _output(self):
+        """
+        Add a node to the array's DAG to compute the partial result of the reduction for each partition. If there
+        are more partitions than tree_reduce_fan_in, the partial results are combined by a tree of executor tasks,
+        and only the final partial result comes back to the driver; otherwise the partial results are combined on
+        the driver.
+        """
+        arr = self.array
+        row_offsets = arr.dag.add_input(
+            [0] + list(np.cumsum(arr.partition_row_counts)[:-1])
+        )
+        if not self._is_tree_reduce():
+            return arr.dag.transform(self.reduction.partial, [arr.input, row_offsets])
+        self._prefix = store_key(arr.intermediate_group, str(uuid.uuid4()))
+        indices = arr.dag.add_input(list(range(len(arr.partition_row_counts))))
+        return arr.dag.transform(
+            partial(
+                write_partial,
+                store_location(arr.intermediate_group.store),
+                self._prefix,
+                self.reduction,
+            ),
+            [indices, arr.input, row_offsets],
+        )
+
+    def _finish(self, partials):
+        """Combine the partial results computed by the node returned by _output."""
+        arr = self.array
+        partials = list(partials)
+        if self._is_tree_reduce():
+            combined = tree_reduce(
+                arr.executor,
+                self.reduction,
+                arr.intermediate_group.store,
+                self._prefix,
+                len(partials),
+                arr.tree_reduce_fan_in,
+            )
+        else:
+            combined = self.reduction.combine(partials)
+        self.value = self.reduction.finalize(combined)
+        self.computed = True
+
+    # Behave like the result
+
+    def __array__(self, dtype=None, **kwargs):
+        return np.asarray(self.result(), dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [
+            input.result() if isinstance(input, LazyReduction) else input
+            for input in inputs
+        ]
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __float__(self):
+        return float(self.result())
+
+    def __int__(self):
+        return int(self.result())
+
+    def __index__(self):
+        return operator.index(self.result())
+
+    def __complex__(self):
+        return complex(self.result())
+
+    def __round__(self, ndigits=None):
+        if ndigits is None:
+            return round(self.result())
+        return round(self.result(), ndigits)
+
+    def __format__(self, format_spec):
+        return format(self.result(), format_spec)
+
+    def __hash__(self):
+        return hash(self.result())
+
+    def item(self, *args):
+        return np.asarray(self.result()).item(*args)
+
+    @property
+    def dtype(self):
+        return np.asarray(self.result()).dtype
+
+    @property
+    def shape(self):
+        return np.shape(self.result())
+
+    @property
+    def ndim(self):
+        return np.ndim(self.result())
+
+    def __bool__(self):
+        return bool(self.result())
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return repr(self.result())
+
+    def __str__(self):
+        return str(self.result())
+
+
+class StoredChunk(object):
+    """A reference to a result chunk that a task wrote to the intermediate store, rather than returning it."""
+
+    def __init__(self, key, nbytes):
+        self.key = key
+        self.nbytes = nbytes
+
+
+def _return_via_store(location, prefix, threshold, index, chunk):
+    if getattr(chunk, "nbytes", 0) <= threshold:
+        return chunk
+    key = "%s/%s" % (prefix, index)
+    store_value(open_store(location), key, chunk)
+    return StoredChunk(key, chunk.nbytes)
+
+
+class StoredOperand(object):
+    """
+    A reference to an operand in the intermediate store, named by a hash of its contents. It holds the store's
+    location (see store_location) rather than the store, so that it is small to send with every task.
+    """
+
+    def __init__(self, location, key, digest):
+        self.location = location
+        self.key = key
+        self.digest = digest
+
+
+def _store_operand(group, value):
+    # operands are named by their contents, so each one is only written once
+    value = np.ascontiguousarray(value)
+    sha = hashlib.sha1(("%s %s " % (value.dtype.str, value.shape)).encode("utf-8"))
+    sha.update(memoryview(value).cast("B"))
+    digest = sha.hexdigest()
+    key = store_key(group, "operands", digest)
+    if key not in group.store:
+        store_value(group.store, key, value)
+    return StoredOperand(store_location(group.store), key, digest)
+
+
+def _load_operand(operand):
+    value = operand_cache.get(operand.digest)
+    if value is None:
+        value = load_value(open_store(operand.location), operand.key)
+        operand_cache.put(operand.digest, value)
+    return value
+
+
+def _persisted_chunk_key(prefix, index):
+    return "%s/%s" % (prefix, index)
+
+
+def _write_persisted_chunk(location, prefix, index, chunk):
+    store_value(open_store(location), _persisted_chunk_key(prefix, index), chunk)
+    chunk_cache.put((prefix, index), chunk)
+
+
+def _read_persisted_chunk(location, prefix, index):
+    chunk = chunk_cache.get((prefix, index))
+    if chunk is None:
+        chunk = load_value(open_store(location), _persisted_chunk_key(prefix, index))
+        chunk_cache.put((prefix, index), chunk)
+    return chunk
+
+
+# the number of chunk-sized values held at once by a task writing a repartitioned chunk: the new
+# chunk, the partial chunks it is assembled from, and its encoded copy
+_REPARTITION_LIVE_CHUNKS = 3
+
+
 class PywrenExecutor(object):
-    """Small wrapper to make a Pywren executor behave like a concurrent.futures.Executor."""
+    """
+    Small wrapper to make a Pywren executor behave like a concurrent.futures.Executor.
+
+    If speculation_fraction is set, then once that fraction of the tasks in a job have finished, backup tasks are
+    invoked for the ones that are still running, and the first result for each task is used.
+    """
 
     def __init__(
-        self, pywren_executor=None, exclude_modules=None, record_job_history=True
+        self,
+        pywren_executor=None,
+        exclude_modules=None,
+        record_job_history=True,
+        speculation_fraction=None,
     ):
         import pywren
 
@@ -52,15 +395,31 @@ class PywrenExecutor(object):
         )
         self.exclude_modules = exclude_modules
         self.record_job_history = record_job_history
+        self.speculation_fraction = speculation_fraction
 
     def map(self, func, iterables):
         import pywren
 
-        futures = self.pywren_executor.map(
-            func, iterables, exclude_modules=self.exclude_modules
-        )
-        pywren.wait(futures, return_when=pywren.ALL_COMPLETED)
-        results = [f.result() for f in futures]
+        if self.speculation_fraction is None:
+            futures = self.pywren_executor.map(
+                func, iterables, exclude_modules=self.exclude_modules
+            )
+            pywren.wait(futures, return_when=pywren.ALL_COMPLETED)
+            results = [f.result() for f in futures]
+        else:
+            results, tasks = speculative_map(
+                lambda f, item: self.pywren_executor.map(
+                    f, [item], exclude_modules=self.exclude_modules
+                )[0],
+                lambda fs: pywren.wait(list(fs), return_when=pywren.ANY_COMPLETED),
+                func,
+                list(iterables),
+                self.speculation_fraction,
+                submit_all=lambda f, items: self.pywren_executor.map(
+                    f, items, exclude_modules=self.exclude_modules
+                ),
+            )
+            futures = [f for task_futures in tasks for f in task_futures]
         if self.record_job_history:
             run_statuses = [f.run_status for f in futures]
             invoke_statuses = [f.invoke_status for f in futures]
@@ -81,6 +440,35 @@ class PywrenExecutor(object):
 class ExecutorZappyArray(ZappyArray):
     """A numpy.ndarray backed by chunked storage"""
 
+    # reductions over more partitions than this combine partial results using a tree of
+    # executor tasks, each of which combines this many partial results (None to combine them
+    # on the driver). The partial results go through the intermediate store, so it must be
+    # shared with the workers (such as a directory or object store) when this is set
+    tree_reduce_fan_in = None
+
+    # result chunks larger than this many bytes are written to the intermediate store by
+    # tasks, and read from there by the driver, rather than being returned through the
+    # executor (None to return all chunks through the executor)
+    result_store_threshold = None
+
+    # the number of threads the driver uses to read result chunks from the intermediate store
+    result_fetch_concurrency = 16
+
+    # operands that are the same for every partition (such as a row to broadcast) and are
+    # larger than this many bytes are written to the intermediate store once, and read by
+    # tasks through a per-process cache, rather than being pickled with every task's
+    # function (None to always pickle them)
+    operand_store_threshold = None
+
+    # the memory available to each task, in bytes; when set, chunk sizes that are not given are
+    # chosen so that tasks are estimated to fit, and chunk sizes that don't fit are rejected
+    # before a job is run (None for no limit)
+    max_task_memory = None
+
+    # the number of chunk-sized values assumed to be held at once by a task, when choosing a chunk
+    # size before the operations on an array are known
+    task_memory_live_chunks = 4
+
     def __init__(
         self,
         executor,
@@ -91,11 +479,15 @@ class ExecutorZappyArray(ZappyArray):
         dtype,
         partition_row_counts=None,
         intermediate_store=None,
+        max_task_memory=None,
     ):
         ZappyArray.__init__(self, shape, chunks, dtype, partition_row_counts)
         self.executor = executor
         self.dag = dag
         self.input = input
+        self._persisted = None
+        if max_task_memory is not None:
+            self.max_task_memory = max_task_memory
         if intermediate_store is None:
             self.intermediate_group = zarr.group()
         else:
@@ -121,15 +513,53 @@ class ExecutorZappyArray(ZappyArray):
         )
 
     @classmethod
-    def from_zarr(cls, executor, zarr_file, intermediate_store=None):
+    def from_zarr(cls, executor, zarr_file, intermediate_store=None, max_task_memory=None):
         """
-        Read a Zarr file as an ExecutorZappyArray object.
+        Read a Zarr file as an ExecutorZappyArray object. If max_task_memory is set, each partition is the largest
+        whole number of Zarr chunks that fits, rather than a single chunk.
         """
         arr = zarr.open(zarr_file, mode="r")
-        return cls.from_ndarray(executor, arr, arr.chunks, intermediate_store)
+        chunks = arr.chunks
+        if max_task_memory is not None:
+            rows = fit_row_chunks(
+                arr.shape,
+                arr.dtype,
+                max_task_memory,
+                cls.task_memory_live_chunks,
+                multiple_of=arr.chunks[0],
+            )
+            chunks = (rows,) + tuple(arr.shape[1:])
+        result = cls.from_ndarray(executor, arr, chunks, intermediate_store)
+        if max_task_memory is not None:
+            result.max_task_memory = max_task_memory
+        return result
 
     @classmethod
-    def zeros(cls, executor, shape, chunks, dtype=float, intermediate_store=None):
+    def _fit_chunks(cls, shape, chunks, dtype, max_task_memory):
+        """
+        Return chunks with at most as many rows as fit in max_task_memory. If chunks is None, the rows that fit, or
+        all the rows if max_task_memory is not set either.
+        """
+        if max_task_memory is None:
+            return tuple(shape) if chunks is None else chunks
+        rows = fit_row_chunks(
+            shape, dtype, max_task_memory, cls.task_memory_live_chunks
+        )
+        if chunks is not None:
+            rows = builtins.min(rows, chunks[0])
+        return (rows,) + tuple(shape[1:])
+
+    @classmethod
+    def zeros(
+        cls,
+        executor,
+        shape,
+        chunks=None,
+        dtype=float,
+        intermediate_store=None,
+        max_task_memory=None,
+    ):
+        chunks = cls._fit_chunks(shape, chunks, dtype, max_task_memory)
         dag = DAG(executor)
         input = dag.add_input(list(get_chunk_sizes(shape, chunks)))
         input = dag.transform(lambda chunk: np.zeros(chunk, dtype=dtype), [input])
@@ -141,10 +571,20 @@ class ExecutorZappyArray(ZappyArray):
             chunks,
             dtype,
             intermediate_store=intermediate_store,
+            max_task_memory=max_task_memory,
         )
 
     @classmethod
-    def ones(cls, executor, shape, chunks, dtype=float, intermediate_store=None):
+    def ones(
+        cls,
+        executor,
+        shape,
+        chunks=None,
+        dtype=float,
+        intermediate_store=None,
+        max_task_memory=None,
+    ):
+        chunks = cls._fit_chunks(shape, chunks, dtype, max_task_memory)
         dag = DAG(executor)
         input = dag.add_input(list(get_chunk_sizes(shape, chunks)))
         input = dag.transform(lambda chunk: np.ones(chunk, dtype=dtype), [input])
@@ -156,31 +596,272 @@ class ExecutorZappyArray(ZappyArray):
             chunks,
             dtype,
             intermediate_store=intermediate_store,
+            max_task_memory=max_task_memory,
         )
 
     @classmethod
+    @profiled("asndarrays")
     def asndarrays(cls, arrays):
-        """Compute all the input arrays in a single executor and return a tuple of ndarrays."""
-        # TODO: cache data read from zarr
-        if (
-            len(arrays) > 0 and len(set([arr.dag for arr in arrays])) == 1
-        ):  # all dags the same
-            array_chunk_tuples = arrays[0].dag.compute_multiple(
-                [arr.input for arr in arrays]
-            )
-            return tuple(
-                ZappyArray._array_chunks_to_ndarray(
-                    array_chunks, arrays[index].partition_row_counts
-                )
-                for (index, array_chunks) in enumerate(array_chunk_tuples)
-            )
+        """
+        Compute all the input arrays and return a tuple of ndarrays. Arrays with the same executor and number of
+        partitions are computed in a single executor job, even if they are from different DAGs, and the jobs for
+        different numbers of partitions are submitted concurrently.
+        """
+        jobs = collections.OrderedDict()
+        for arr in arrays:
+            key = (id(arr.executor), arr.dag.num_partitions)
+            jobs.setdefault(key, []).append(arr)
+        if len(jobs) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+                job_results = list(pool.map(cls._asndarrays_job, jobs.values()))
         else:
-            return tuple(arr.asndarray() for arr in arrays)
+            job_results = [cls._asndarrays_job(job) for job in jobs.values()]
+        results = {}
+        for job, ndarrays in zip(jobs.values(), job_results):
+            for arr, ndarray in zip(job, ndarrays):
+                results[id(arr)] = ndarray
+        return tuple(results[id(arr)] for arr in arrays)
+
+    @staticmethod
+    def _asndarrays_job(arrays):
+        # arrays from the same DAG share a program, so common nodes are computed once
+        dag_arrays = collections.OrderedDict()
+        for arr in arrays:
+            dag_arrays.setdefault(id(arr.dag), (arr.dag, []))[1].append(arr)
+        result_outputs = {id(arr): arr._result_output() for arr in arrays}
+        dag_outputs = [
+            (dag, [result_outputs[id(arr)][0] for arr in dag_array_list])
+            for dag, dag_array_list in dag_arrays.values()
+        ]
+        dag_chunks = compute_merged(dag_outputs)
+        ndarrays = {}
+        for (_, dag_array_list), output_chunks in zip(dag_arrays.values(), dag_chunks):
+            for arr, chunks in zip(dag_array_list, output_chunks):
+                chunks = arr._fetch_results(chunks, result_outputs[id(arr)][1])
+                ndarrays[id(arr)] = arr._assemble_chunks(chunks)
+        return [ndarrays[id(arr)] for arr in arrays]
+
+    def asndarray_async(self):
+        """An asyncio version of asndarray (see zappy.executor.aio)."""
+        from zappy.executor import aio
+
+        return aio.asndarray(self)
+
+    def asndarray(self):
+        # copy each partition into a preallocated array as soon as it is complete,
+        # rather than holding all the partitions and then concatenating them
+        offsets = [0] + list(np.cumsum(self.partition_row_counts))
+        arr = None
+        placed = set()
+        output, prefix = self._result_output()
+        if prefix is None:
+            for index, chunk in self.dag.compute_as_completed(output):
+                arr = self._place_chunk(arr, offsets, index, chunk)
+                placed.add(index)
+        else:
+            # read chunks that were returned via the intermediate store in parallel
+            store = self.intermediate_group.store
+            fetches = {}
+            try:
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.result_fetch_concurrency
+                ) as pool:
+                    for index, chunk in self.dag.compute_as_completed(output):
+                        if isinstance(chunk, StoredChunk):
+                            fetches[pool.submit(load_value, store, chunk.key)] = index
+                        else:
+                            arr = self._place_chunk(arr, offsets, index, chunk)
+                            placed.add(index)
+                    for future in concurrent.futures.as_completed(fetches):
+                        index = fetches.pop(future)
+                        arr = self._place_chunk(arr, offsets, index, future.result())
+                        placed.add(index)
+            finally:
+                delete_values(store, prefix)
+        # every partition must have been computed, or part of the preallocated array is uninitialized
+        assert len(placed) == len(self.partition_row_counts), (
+            "Computed partitions: %s; partition row counts: %s"
+            % (sorted(placed), self.partition_row_counts)
+        )
+        return arr
+
+    def _assemble_chunks(self, chunks):
+        # copy the partitions of a merged job into a preallocated array, as asndarray does, releasing
+        # each partition once it has been copied rather than concatenating them all at the end
+        assert len(chunks) == len(self.partition_row_counts), (
+            "%s partitions; partition row counts: %s"
+            % (len(chunks), self.partition_row_counts)
+        )
+        offsets = [0] + list(np.cumsum(self.partition_row_counts))
+        arr = None
+        for index in range(len(chunks)):
+            arr = self._place_chunk(arr, offsets, index, chunks[index])
+            chunks[index] = None
+        return arr
+
+    def _place_chunk(self, arr, offsets, index, chunk):
+        # copy a partition into the result array, allocating it for the first partition
+        assert len(chunk) == self.partition_row_counts[index], (
+            "Partition %s has %s rows; partition row counts: %s"
+            % (index, len(chunk), self.partition_row_counts)
+        )
+        if arr is None:
+            arr = np.empty((offsets[-1],) + chunk.shape[1:], dtype=chunk.dtype)
+        elif arr.dtype != chunk.dtype:
+            arr = arr.astype(np.result_type(arr, chunk))
+        arr[offsets[index] : offsets[index + 1]] = chunk
+        return arr
 
     def _compute(self):
-        return list(self.dag.compute(self.input))
+        output, prefix = self._result_output()
+        return self._fetch_results(self.dag.compute(output), prefix)
+
+    def _result_output(self):
+        """
+        Return the DAG node for this array's chunks as they are returned to the driver, and the store prefix for
+        chunks that are returned via the intermediate store (None if result_store_threshold is not set).
+        """
+        if self.result_store_threshold is None:
+            return self.input, None
+        prefix = store_key(self.intermediate_group, "results", str(uuid.uuid4()))
+        indices = self.dag.add_input(list(range(len(self.partition_row_counts))))
+        output = self.dag.transform(
+            partial(
+                _return_via_store,
+                store_location(self.intermediate_group.store),
+                prefix,
+                self.result_store_threshold,
+            ),
+            [indices, self.input],
+        )
+        return output, prefix
+
+    def _fetch_results(self, chunks, prefix):
+        """
+        Return the chunks computed for the node returned by _result_output, with any that were returned via the
+        intermediate store read from it (in parallel), and then deleted.
+        """
+        chunks = list(chunks)
+        if prefix is None:
+            return chunks
+        store = self.intermediate_group.store
+        stored = [i for i, chunk in enumerate(chunks) if isinstance(chunk, StoredChunk)]
+        try:
+            if len(stored) > 0:
+                with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=min(len(stored), self.result_fetch_concurrency)
+                ) as pool:
+                    keys = [chunks[i].key for i in stored]
+                    fetched = pool.map(partial(load_value, store), keys)
+                    for i, chunk in zip(stored, fetched):
+                        chunks[i] = chunk
+        finally:
+            delete_values(store, prefix)
+        return chunks
+
+    # Caching
+
+    def persist(self):
+        """
+        Compute this array and store its partitions in the intermediate store, so that later computations read
+        them from there rather than recomputing them from the original inputs. Partitions are also held in the
+        bounded, least-recently-used in-memory chunk cache of the process that reads or writes them.
+
+        Arrays derived from this one after it has been persisted read from the intermediate store, so they cannot
+        be computed once this array has been unpersisted.
+        :return: this array
+        """
+        if self.is_persisted:
+            return self
+        prefix = store_key(self.intermediate_group, str(uuid.uuid4()))
+        location = store_location(self.intermediate_group.store)
+        indices = self.dag.add_input(list(range(len(self.partition_row_counts))))
+        output = self.dag.transform(
+            partial(_write_persisted_chunk, location, prefix), [indices, self.input]
+        )
+        list(self.dag.compute(output))
+
+        dag = DAG(self.executor)
+        input = dag.add_input(list(range(len(self.partition_row_counts))))
+        input = dag.transform(partial(_read_persisted_chunk, location, prefix), [input])
+        self._persisted = (prefix, self.dag, self.input, input)
+        self.dag = dag
+        self.input = input
+        return self
+
+    def cache(self):
+        """Same as persist()."""
+        return self.persist()
+
+    def unpersist(self):
+        """
+        Remove this array's partitions from the intermediate store and the chunk cache, and go back to computing
+        them from the original inputs.
+        :return: this array
+        """
+        if not self.is_persisted:
+            return self
+        prefix, dag, input, _ = self._persisted
+        chunk_cache.invalidate(prefix)
+        delete_values(self.intermediate_group.store, prefix)
+        self._persisted = None
+        self.dag = dag
+        self.input = input
+        return self
+
+    def _new(self, **kwargs):
+        obj = ZappyArray._new(self, **kwargs)
+        if obj is not self:
+            # only the array that was persisted can unpersist it, since copies and derived arrays still read its
+            # chunks from the intermediate store
+            obj._persisted = None
+        return obj
+
+    @property
+    def is_persisted(self):
+        # arrays derived from a persisted array are copies with a different input
+        return self._persisted is not None and self._persisted[3] is self.input
+
+    def estimate_task_memory(self):
+        """
+        Return the estimated peak memory, in bytes, of a task computing a partition of this array, from the chunk
+        size, dtype, and the number of chunk-sized values that the task holds at once.
+        """
+        program = Program([self.input])
+        return estimate_task_memory(self.chunks, self.dtype, live_chunks(program))
+
+    def to_zarr(self, zarr_file, chunks=None, ncopies=1):
+        """
+        Write an ZappyArray object to a Zarr file. If chunks is None, the chunks have as many rows as fit in
+        max_task_memory, or are the same as the array's chunks if it is not set.
+        """
+        if chunks is None:
+            if self.max_task_memory is None:
+                chunks = self.chunks
+            else:
+                rows = fit_row_chunks(
+                    self.shape,
+                    self.dtype,
+                    self.max_task_memory,
+                    _REPARTITION_LIVE_CHUNKS,
+                )
+                chunks = (rows,) + tuple(self.shape[1:])
+        return ZappyArray.to_zarr(self, zarr_file, chunks, ncopies)
+
+    def to_zarr_async(self, zarr_file, chunks=None, ncopies=1):
+        """An asyncio version of to_zarr (see zappy.executor.aio)."""
+        from zappy.executor import aio
+
+        return aio.to_zarr(self, zarr_file, chunks, ncopies)
 
     def _repartition_chunks(self, chunks):
+        if self.max_task_memory is not None:
+            needed = estimate_task_memory(chunks, self.dtype, _REPARTITION_LIVE_CHUNKS)
+            if needed > self.max_task_memory:
+                raise ValueError(
+                    "Chunks of %s rows need an estimated %s bytes per task, more than max_task_memory of %s bytes"
+                    % (chunks[0], needed, self.max_task_memory)
+                )
         c = chunks[0]
         partition_row_ranges, total_rows, new_num_partitions = calculate_partition_boundaries(
             chunks, self.partition_row_counts
@@ -230,7 +911,13 @@ class ExecutorZappyArray(ZappyArray):
 
         # TODO: delete intermediate store when dag is computed
         return ExecutorZappyArray(
-            self.executor, dag, input, self.shape, chunks, self.dtype
+            self.executor,
+            dag,
+            input,
+            self.shape,
+            chunks,
+            self.dtype,
+            max_task_memory=self.max_task_memory,
         )
 
     def _write_zarr(self, store, chunks, write_chunk_fn):
@@ -244,34 +931,9 @@ class ExecutorZappyArray(ZappyArray):
 
     def _calc_mean(self, axis=None):
         if axis is None:
-            result = self._new(
-                input=self.dag.transform(
-                    lambda x: (x.shape[0] * x.shape[1], np.sum(x, axis=axis)),
-                    [self.input],
-                )
-            )._compute()
-            total_count = builtins.sum([res[0] for res in result])
-            mean = np.sum([res[1] for res in result], axis=axis) / total_count
-            return mean
+            return LazyReduction(self._new(), MeanReduction(axis))
         elif axis == 0:  # mean of each column
-            result = self._new(
-                input=self.dag.transform(
-                    lambda x: (x.shape[0], np.sum(x, axis=axis)), [self.input]
-                )
-            )._compute()
-            total_count = builtins.sum([res[0] for res in result])
-            mean = np.sum([res[1] for res in result], axis=axis) / total_count
-            # new dag
-            dag = DAG(self.executor)
-            partitioned_input = [mean]
-            input = dag.add_input(partitioned_input)
-            return self._new(
-                dag=dag,
-                input=input,
-                shape=mean.shape,
-                chunks=mean.shape,
-                partition_row_counts=mean.shape,
-            )
+            return self._reduced_array(LazyReduction(self._new(), MeanReduction(axis)))
         return NotImplemented
 
     def _calc_func_axis_rowwise(self, func, axis):
@@ -279,55 +941,138 @@ class ExecutorZappyArray(ZappyArray):
         return self._new(input=input, shape=(self.shape[0],), chunks=(self.chunks[0],))
 
     def _calc_func_axis_distributive(self, func, axis):
-        per_chunk_result = self._new(
-            input=self.dag.transform(lambda x: func(x, axis=axis), [self.input])
-        )._compute()
-        result = func(per_chunk_result, axis=axis)
+        if func in (np.argmin, np.argmax):
+            reduction = ArgReduction(func, axis)
+        else:
+            reduction = DistributiveReduction(func, axis)
         if axis is None:
-            return result
+            return LazyReduction(self._new(), reduction)
         elif axis == 0:  # column-wise
-            # new dag
-            dag = DAG(self.executor)
-            partitioned_input = [result]
-            input = dag.add_input(partitioned_input)
-            return self._new(
-                dag=dag,
-                input=input,
-                shape=result.shape,
-                chunks=result.shape,
-                partition_row_counts=result.shape,
-            )
+            return self._reduced_array(LazyReduction(self._new(), reduction))
         return NotImplemented
 
+    def _reduced_array(self, result):
+        # new dag, with a single partition that is computed lazily
+        dag = DAG(self.executor)
+        partitioned_input = [result]
+        input = dag.add_input(partitioned_input)
+        shape = (self.shape[1],)
+        return self._new(
+            dag=dag,
+            input=input,
+            shape=shape,
+            chunks=shape,
+            partition_row_counts=shape,
+        )
+
     # Distributed ufunc internal implementation
 
+    def _dist_ufunc(self, func, args, out=None, dtype=None):
+        # operands that depend on reductions that have not been computed yet are side inputs, so
+        # the reductions run as an earlier stage when this array is computed
+        if len(args) == 1:
+            operand = self._deferred_operand(args[0])
+            if operand is not None:
+                input = self._elementwise(func, [self.input, operand])
+                return self._new(input=input, out=out, dtype=dtype)
+        # lazy reductions that have been computed are used as values
+        args = [arg.result() if isinstance(arg, LazyReduction) else arg for arg in args]
+        return ZappyArray._dist_ufunc(self, func, args, out=out, dtype=dtype)
+
+    def _deferred_operand(self, other):
+        """
+        Return a DAG node for an operand that depends on a reduction that has not been computed: a reduction over
+        all elements, or a row computed from reductions over columns (such as x.mean(axis=0)). Return None for
+        other operands.
+        """
+        num_partitions = len(self.partition_row_counts)
+        if isinstance(other, LazyReduction):
+            if other.computed:
+                return None
+            return self.dag.add_input([other] * num_partitions)
+        if (
+            not isinstance(other, ExecutorZappyArray)
+            or other.dag is self.dag
+            or other.ndim != 1
+            or self.ndim != 2
+            or other.shape[0] != self.shape[1]
+            or len(other.partition_row_counts) != 1
+            or len(_pending_reductions(other)) == 0
+        ):
+            return None
+        # copy the row's single-partition DAG into this one, with its inputs repeated for every partition
+        nodes = {}
+
+        def copy(node):
+            if id(node) not in nodes:
+                if isinstance(node, Input):
+                    values = other.dag.partitioned_inputs[node.index]
+                    nodes[id(node)] = self.dag.add_input(values * num_partitions)
+                else:
+                    inputs = [copy(input) for input in node.inputs]
+                    nodes[id(node)] = self.dag.transform(node.func, inputs)
+            return nodes[id(node)]
+
+        return copy(other.input)
+
+    def _broadcast_operand(self, value):
+        """
+        Return an operand that is the same for every partition: the value itself, or a DAG node that reads it from
+        the intermediate store if it is larger than operand_store_threshold.
+        """
+        if (
+            self.operand_store_threshold is None
+            or not isinstance(value, np.ndarray)
+            or value.nbytes <= self.operand_store_threshold
+        ):
+            return value
+        operand = _store_operand(self.intermediate_group, value)
+        references = self.dag.add_input([operand] * len(self.partition_row_counts))
+        return self.dag.transform(_load_operand, [references])
+
+    def _elementwise(self, func, operands):
+        # consecutive ufuncs are fused into a single kernel; other functions become separate transforms
+        if isinstance(func, np.ufunc):
+            kernel, inputs = fuse(func, operands)
+            return self.dag.transform(kernel, inputs)
+        return self.dag.transform(func, operands)
+
     def _unary_ufunc(self, func, out=None, dtype=None):
-        input = self.dag.transform(func, [self.input])
+        input = self._elementwise(func, [self.input])
         return self._new(input=input, out=out, dtype=dtype)
 
     def _binary_ufunc_self(self, func, out=None, dtype=None):
-        input = self.dag.transform(lambda x: func(x, x), [self.input])
+        input = self._elementwise(func, [self.input, self.input])
         return self._new(input=input, out=out, dtype=dtype)
 
     def _binary_ufunc_broadcast_single_row_or_value(
         self, func, other, out=None, dtype=None
     ):
-        other = np.asarray(other)  # materialize
-        input = self.dag.transform(lambda x: func(x, other), [self.input])
+        other = self._broadcast_operand(np.asarray(other))  # materialize
+        input = self._elementwise(func, [self.input, other])
         return self._new(input=input, out=out, dtype=dtype)
 
     def _binary_ufunc_broadcast_single_column(self, func, other, out=None, dtype=None):
+        if (
+            isinstance(other, ExecutorZappyArray)
+            and other.dag is self.dag
+            and other.partition_row_counts == self.partition_row_counts
+        ):
+            # computed from the same partitions (such as a row sum), so each partition of this
+            # array is zipped with the matching partition of other in the DAG
+            input = self._elementwise(func, [self.input, other.input])
+            return self._new(input=input, out=out, dtype=dtype)
         other = np.asarray(other)  # materialize
         partition_row_subsets = ZappyArray._copartition(
             other, self.partition_row_counts
         )
         side_input = self.dag.add_input(partition_row_subsets)
-        input = self.dag.transform(func, [self.input, side_input])
+        input = self._elementwise(func, [self.input, side_input])
         return self._new(input=input, out=out, dtype=dtype)
 
     def _binary_ufunc_same_shape(self, func, other, out=None, dtype=None):
         if self.partition_row_counts == other.partition_row_counts:
-            input = self.dag.transform(func, [self.input, other.input])
+            input = self._elementwise(func, [self.input, other.input])
             return self._new(input=input, out=out, dtype=dtype)
         return NotImplemented
 
@@ -360,7 +1105,12 @@ class ExecutorZappyArray(ZappyArray):
         new_num_cols = ZappyArray._compute_dim(self.shape[1], subset)
         new_shape = (self.shape[0], new_num_cols)
         new_chunks = (self.chunks[0], new_num_cols)
-        input = self.dag.transform(lambda x: x[item], [self.input])
+        operand = self._broadcast_operand(subset)
+        if operand is subset:
+            input = self.dag.transform(lambda x: x[item], [self.input])
+        else:
+            rows = item[0]
+            input = self.dag.transform(lambda x, y: x[rows, y], [self.input, operand])
         return self._new(input=input, shape=new_shape, chunks=new_chunks)
 
     def _row_subset(self, item):
@@ -0,0 +1,64 @@
+import collections
+import threading
+
+
+class ChunkCache(object):
+    """A thread-safe LRU cache of array chunks, bounded by the total number of bytes held."""
+
+    def __init__(self, max_bytes=2 ** 30):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        """Return the chunk for the key, or None if it is not cached."""
+        with self._lock:
+            chunk = self._entries.pop(key, None)
+            if chunk is not None:
+                self._entries[key] = chunk  # most recently used (OrderedDict.move_to_end is Python 3 only)
+            return chunk
+
+    def put(self, key, chunk):
+        """Cache a chunk, evicting least recently used chunks to stay within max_bytes."""
+        nbytes = getattr(chunk, "nbytes", 0)
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.max_bytes:
+                return  # would evict everything else and still not fit
+            self._entries[key] = chunk
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= getattr(evicted, "nbytes", 0)
+
+    def invalidate(self, name):
+        """Remove all the chunks whose key is of the form (name, index)."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == name]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _remove(self, key):
+        chunk = self._entries.pop(key, None)
+        if chunk is not None:
+            self.nbytes -= getattr(chunk, "nbytes", 0)
+
+
+# Chunks of persisted arrays that have been read or written in this process
+chunk_cache = ChunkCache()
+
+# Operands that have been read from the intermediate store in this process, keyed by a hash of their contents
+operand_cache = ChunkCache(max_bytes=2 ** 28)
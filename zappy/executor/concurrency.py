@@ -0,0 +1,241 @@
+import collections
+import concurrent.futures
+import random
+import threading
+import time
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
+
+# Adaptive control of the number of tasks in flight, for jobs whose tasks share a bottleneck such as an object
+# store bucket prefix, where running too many tasks at once causes throttling and makes the whole job slower.
+
+
+class ThrottlingError(IOError):
+    """Raised by a store that is receiving more requests than it can serve (like S3's SlowDown error)."""
+
+
+class FixedConcurrencyPolicy(object):
+    """A policy that always allows the same number of tasks in flight; useful as a baseline."""
+
+    def __init__(self, limit):
+        assert limit >= 1
+        self._limit = limit
+
+    def limit(self):
+        return self._limit
+
+    def record(self, latency, throttled):
+        pass
+
+
+class AIMDPolicy(object):
+    """
+    An additive increase, multiplicative decrease (AIMD) concurrency policy, like TCP congestion control. Each task
+    that finishes without being throttled increases the limit by additive_increase / limit (so the limit grows by
+    about additive_increase for each limit's worth of tasks). A throttled task, or one whose latency is more than
+    latency_threshold seconds, multiplies the limit by multiplicative_decrease, but at most once for each limit's
+    worth of tasks finishing, so that a burst of throttled tasks only counts as one congestion signal.
+
+    A policy has two methods: limit(), the number of tasks that may be in flight, and record(latency, throttled),
+    called for every task that finishes. Any object with these methods can be used with
+    AdaptiveConcurrencyExecutor.
+    """
+
+    def __init__(
+        self,
+        initial_limit=8,
+        min_limit=1,
+        max_limit=1000,
+        additive_increase=1.0,
+        multiplicative_decrease=0.5,
+        latency_threshold=None,
+    ):
+        assert 1 <= min_limit <= initial_limit <= max_limit
+        assert 0 < multiplicative_decrease < 1
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.latency_threshold = latency_threshold
+        self._limit = float(initial_limit)
+        self._since_decrease = None  # tasks recorded since the last decrease
+        self._lock = threading.Lock()
+
+    def limit(self):
+        with self._lock:
+            return int(self._limit)
+
+    def record(self, latency, throttled):
+        with self._lock:
+            congested = throttled or (
+                self.latency_threshold is not None and latency > self.latency_threshold
+            )
+            if self._since_decrease is not None:
+                self._since_decrease += 1
+            if not congested:
+                self._limit = min(
+                    self.max_limit, self._limit + self.additive_increase / self._limit
+                )
+            elif self._since_decrease is None or self._since_decrease >= self._limit:
+                self._limit = max(
+                    self.min_limit, self._limit * self.multiplicative_decrease
+                )
+                self._since_decrease = 0
+
+
+class AdaptiveConcurrencyExecutor(object):
+    """
+    An executor that limits the number of tasks it has in flight on the executor it wraps, adjusting the limit
+    with a policy (AIMDPolicy by default) as tasks finish. Tasks that raise one of the exceptions in throttle_on are
+    reported to the policy as throttled, and resubmitted, up to max_attempts times, after which the exception is
+    raised. Other exceptions fail the job.
+
+    The wrapped executor must have a submit method, and enough workers for the maximum limit of the policy. For
+    each job, history records (time, limit, tasks in flight) whenever a task finishes, and throttled is the number
+    of throttled attempts.
+    """
+
+    def __init__(self, executor, policy=None, throttle_on=(IOError,), max_attempts=5):
+        assert max_attempts >= 1
+        self.executor = executor
+        self.policy = AIMDPolicy() if policy is None else policy
+        self.throttle_on = throttle_on
+        self.max_attempts = max_attempts
+        self.history = []
+        self.throttled = 0
+
+    def map(self, func, *iterables):
+        items = list(zip(*iterables))
+        results = [None] * len(items)
+        attempts = [0] * len(items)
+        queue = collections.deque(range(len(items)))
+        running = {}  # future -> (index, submit time)
+        self.history = []
+        self.throttled = 0
+        try:
+            while queue or running:
+                while queue and len(running) < max(1, self.policy.limit()):
+                    i = queue.popleft()
+                    attempts[i] += 1
+                    running[self.executor.submit(func, *items[i])] = (i, time.time())
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                finished = time.time()
+                for future in done:
+                    i, submitted = running.pop(future)
+                    try:
+                        results[i] = future.result()
+                    except self.throttle_on:
+                        self.throttled += 1
+                        self.policy.record(finished - submitted, throttled=True)
+                        if attempts[i] >= self.max_attempts:
+                            raise
+                        queue.append(i)
+                    else:
+                        self.policy.record(finished - submitted, throttled=False)
+                self.history.append((finished, self.policy.limit(), len(running)))
+        finally:
+            for future in running:
+                future.cancel()
+        return iter(results)
+
+    def shutdown(self, wait=True):
+        if hasattr(self.executor, "shutdown"):
+            self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
+
+
+class SimulatedObjectStore(MutableMapping):
+    """
+    An in-memory Zarr store that simulates an object store, for benchmarking concurrency offline. Each request
+    (get, set or delete) takes latency seconds, plus the time to transfer its value at bandwidth bytes per second
+    (if set). When more than capacity requests are in flight, a request fails with ThrottlingError with probability
+    throttle_probability, after the latency, like a throttled request to S3.
+
+    The store's state is in memory, so it can only be used with executors that run tasks in threads. It counts
+    requests and throttled requests.
+    """
+
+    def __init__(
+        self,
+        latency=0.01,
+        bandwidth=None,
+        capacity=16,
+        throttle_probability=1.0,
+        seed=None,
+    ):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.capacity = capacity
+        self.throttle_probability = throttle_probability
+        self.requests = 0
+        self.throttled = 0
+        self._data = {}
+        self._in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _request(self, key, nbytes, action):
+        with self._lock:
+            self.requests += 1
+            self._in_flight += 1
+            throttle = (
+                self._in_flight > self.capacity
+                and self._random.random() < self.throttle_probability
+            )
+            if throttle:
+                self.throttled += 1
+        try:
+            duration = self.latency
+            if self.bandwidth is not None and not throttle:
+                duration += nbytes / float(self.bandwidth)
+            time.sleep(duration)
+            if throttle:
+                raise ThrottlingError("slow down: too many requests for %s" % key)
+            return action()
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._data[key]  # raises KeyError without a request, like a cached listing
+        return self._request(key, len(value), lambda: value)
+
+    def __setitem__(self, key, value):
+        value = bytes(value)
+
+        def put():
+            with self._lock:
+                self._data[key] = value
+
+        self._request(key, len(value), put)
+
+    def __delitem__(self, key):
+        def delete():
+            with self._lock:
+                del self._data[key]
+
+        self._request(key, 0, delete)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._data))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
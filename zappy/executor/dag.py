@@ -1,17 +1,20 @@
 import concurrent.futures
 
 
-def unpack_args(f):
-    return lambda x: f(*x)
+class Deferred(object):
+    """
+    A partition value that is computed on the driver the first time it is needed, such as the result of a lazy
+    reduction. Subclasses implement result().
+    """
+
+    def result(self):
+        raise NotImplementedError
 
 
 class Input:
     def __init__(self, index):
         self.index = index
 
-    def compute(self, input_values):
-        return input_values[self.index]
-
     def node(self):
         return '"Input({}, {})"'.format(id(self), self.index)
 
@@ -26,10 +29,6 @@ class LazyVal:
         self.func = func
         self.inputs = inputs
 
-    def compute(self, input_values):
-        computed_inputs = [input.compute(input_values) for input in self.inputs]
-        return unpack_args(self.func)(computed_inputs)
-
     def node(self):
         return '"LazyVal({}, {})"'.format(id(self), self.func)
 
@@ -41,6 +40,162 @@ class LazyVal:
         return s
 
 
+def _topological_sort(outputs):
+    """Return all the nodes that the outputs depend on, with every node after its inputs."""
+    seen = set()
+    nodes = []
+    stack = [(output, False) for output in reversed(outputs)]
+    while stack:
+        node, expanded = stack.pop()
+        if expanded:
+            nodes.append(node)
+            continue
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        stack.append((node, True))
+        if isinstance(node, LazyVal):
+            stack.extend((input, False) for input in reversed(node.inputs))
+    return nodes
+
+
+class Program(object):
+    """
+    The part of a DAG needed to compute some outputs, lowered to a flat list of instructions that is evaluated
+    for one partition at a time with a simple loop.
+
+    Evaluation uses numbered slots. The first slots hold the partition's input values, in the order given by
+    input_indices, and each instruction applies its function to the values in some slots and stores the result in
+    a new slot. A slot is cleared after the last instruction that uses it, so intermediate values can be freed.
+
+    Functions with a true reuses_buffers attribute are passed an out keyword argument when one of their arguments
+    is not used by any later instruction and was computed by a function with a true owns_result attribute (so it
+    is a fresh buffer, not an input or a view of another value), and no value that is still needed may be a view
+    of it. They may write their result into it.
+    """
+
+    def __init__(self, outputs, multiple=False):
+        nodes = _topological_sort(outputs)
+        input_nodes = sorted(
+            [node for node in nodes if isinstance(node, Input)],
+            key=lambda node: node.index,
+        )
+        self.input_indices = [node.index for node in input_nodes]
+        slots = {}
+        for node in input_nodes:
+            slots[id(node)] = len(slots)
+        instructions = []
+        for node in nodes:
+            if isinstance(node, LazyVal):
+                args = tuple(slots[id(input)] for input in node.inputs)
+                slots[id(node)] = len(slots)
+                instructions.append((node.func, args, slots[id(node)]))
+        self.num_slots = len(slots)
+        self.output_slots = tuple(slots[id(output)] for output in outputs)
+        self.multiple = multiple
+
+        # find the last instruction that uses each slot, so it can be released
+        last_use = {}
+        for i, (_, args, _) in enumerate(instructions):
+            for arg in args:
+                last_use[arg] = i
+        releases = [[] for _ in instructions]
+        for slot, i in last_use.items():
+            if slot not in self.output_slots:
+                releases[i].append(slot)
+
+        # find the owned buffers that each slot may be a view of: its own buffer if its function owns its result,
+        # otherwise any buffer that one of its arguments may be a view of (inputs are never written to)
+        owned = set()
+        views = {}
+        for func, args, out in instructions:
+            if getattr(func, "owns_result", False):
+                owned.add(out)
+                views[out] = {out}
+            else:
+                views[out] = set().union(*[views.get(arg, set()) for arg in args])
+
+        # find a released buffer that each instruction can write its result into: one that no other value that
+        # is still needed (including the other arguments of the instruction) may be a view of
+        self.instructions = []
+        for i, ((func, args, out), release) in enumerate(zip(instructions, releases)):
+            reuse = None
+            if getattr(func, "reuses_buffers", False):
+                reusable = [
+                    arg
+                    for arg in args
+                    if arg in release
+                    and arg in owned
+                    and not any(
+                        slot != arg
+                        and arg in slot_views
+                        and (last_use.get(slot, -1) >= i or slot in self.output_slots)
+                        for slot, slot_views in views.items()
+                    )
+                ]
+                reuse = reusable[0] if len(reusable) > 0 else None
+            self.instructions.append((func, args, out, tuple(release), reuse))
+
+    def __call__(self, input_values):
+        slots = [None] * self.num_slots
+        slots[: len(input_values)] = input_values
+        for func, args, out, release, reuse in self.instructions:
+            if reuse is None:
+                slots[out] = func(*[slots[arg] for arg in args])
+            else:
+                slots[out] = func(*[slots[arg] for arg in args], out=slots[reuse])
+            for slot in release:
+                slots[slot] = None
+        if self.multiple:
+            return tuple(slots[slot] for slot in self.output_slots)
+        return slots[self.output_slots[0]]
+
+
+class MergedProgram(object):
+    """
+    Programs for several DAGs with the same number of partitions, evaluated together for one partition at a time,
+    so they can be computed by a single executor job. The outputs of all the programs are returned in one tuple.
+    """
+
+    def __init__(self, programs):
+        self.programs = programs
+
+    def __call__(self, input_values):
+        results = []
+        for program, values in zip(self.programs, input_values):
+            results.extend(program(values))
+        return tuple(results)
+
+
+def compute_merged(dag_outputs):
+    """
+    Compute outputs from several DAGs, which must all have the same executor and number of partitions, in a single
+    executor job. dag_outputs is a list of (dag, outputs) pairs; the result is a list with an entry for each pair,
+    which is a tuple with the partition values of each of its outputs.
+    """
+    dag = dag_outputs[0][0]
+    # run single partitions locally
+    executor = dag.local_executor if dag.num_partitions == 1 else dag.executor
+    programs = [Program(outputs, multiple=True) for _, outputs in dag_outputs]
+    zipped_inputs = zip(
+        *[
+            dag._get_zipped_inputs(program)
+            for (dag, _), program in zip(dag_outputs, programs)
+        ]
+    )
+    output_chunks = list(zip(*executor.map(MergedProgram(programs), zipped_inputs)))
+    results = []
+    start = 0
+    for _, outputs in dag_outputs:
+        results.append(tuple(output_chunks[start : start + len(outputs)]))
+        start += len(outputs)
+    return results
+
+
+def _resolve(value):
+    return value.result() if isinstance(value, Deferred) else value
+
+
 class DAG:
     def __init__(self, executor):
         self.executor = executor
@@ -70,20 +225,57 @@ class DAG:
         assert len(inputs) > 0
         return LazyVal(func, inputs)
 
-    def _get_zipped_inputs(self):
-        # iterate over inputs one partition at a time
-        return zip(*self.partitioned_inputs)
+    def _get_zipped_inputs(self, program):
+        # iterate over inputs one partition at a time, only including the inputs that
+        # the program uses
+        return list(
+            zip(
+                *[
+                    [_resolve(value) for value in self.partitioned_inputs[i]]
+                    for i in program.input_indices
+                ]
+            )
+        )
+
+    def deferred_inputs(self, outputs):
+        """Return the deferred values that computing the outputs depends on."""
+        program = Program(outputs)
+        return [
+            value
+            for i in program.input_indices
+            for value in self.partitioned_inputs[i]
+            if isinstance(value, Deferred)
+        ]
 
     def compute(self, output):
         # Uncomment to see the dot representation of the DAG
         # print("digraph compute {{\n{}}}".format(output.dot()))
-        if len(list(self._get_zipped_inputs())) == 1:
+        program = Program([output])
+        if self.num_partitions == 1:
             # run single partitions locally
-            return self.local_executor.map(output.compute, self._get_zipped_inputs())
-        return self.executor.map(output.compute, self._get_zipped_inputs())
+            return self.local_executor.map(program, self._get_zipped_inputs(program))
+        return self.executor.map(program, self._get_zipped_inputs(program))
 
-    def compute_multiple(self, outputs):
-        def apply_multiple(x):
-            return tuple(f(x) for f in tuple(output.compute for output in outputs))
+    def compute_as_completed(self, output):
+        """
+        Compute the output, yielding (partition index, result) pairs in the order that partitions complete.
+        """
+        program = Program([output])
+        zipped_inputs = self._get_zipped_inputs(program)
+        executor = self.local_executor if self.num_partitions == 1 else self.executor
+        if not hasattr(executor, "submit"):  # e.g. PywrenExecutor
+            for index, result in enumerate(executor.map(program, zipped_inputs)):
+                yield index, result
+            return
+        futures = {
+            executor.submit(program, values): index
+            for index, values in enumerate(zipped_inputs)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            # drop our reference to the future so its result can be freed once consumed
+            index = futures.pop(future)
+            yield index, future.result()
 
-        return zip(*self.executor.map(apply_multiple, self._get_zipped_inputs()))
+    def compute_multiple(self, outputs):
+        program = Program(outputs, multiple=True)
+        return zip(*self.executor.map(program, self._get_zipped_inputs(program)))
@@ -0,0 +1,417 @@
+import concurrent.futures
+import datetime
+import json
+import os
+import pickle
+import threading
+import time
+
+from zappy import serialization
+from zappy.executor.dag import MergedProgram, Program
+from zappy.zarr_util import get_io_counters, reset_io_counters
+
+# Wrappers that add behaviour to a concurrent.futures.Executor (or a PywrenExecutor). They only rely on the map
+# method of the wrapped executor, and provide the same interface, so they can be stacked.
+
+
+def speculative_map(submit, wait, func, items, speculation_fraction, submit_all=None):
+    """
+    Apply func to each item in items, with speculative execution of stragglers. Once speculation_fraction of the
+    tasks have finished, a backup task is submitted for each task that is still running, and the result of
+    whichever finishes first is used.
+
+    submit(func, item) starts a task and returns a future, and wait(futures) blocks until at least one of the
+    futures has finished, returning the sets of finished and unfinished futures. If submit_all(func, items) is
+    given, it starts the tasks for all the items at once (such as with a single Pywren map), returning a future
+    for each, and submit is only used for backup tasks.
+
+    :return: the list of results, and the list of futures for each item (with any backup)
+    """
+    if submit_all is not None:
+        tasks = [[future] for future in submit_all(func, items)]
+    else:
+        tasks = [[submit(func, item)] for item in items]
+    task_index = {future: i for i, futures in enumerate(tasks) for future in futures}
+    results = [None] * len(items)
+    finished = [False] * len(items)
+    num_finished = 0
+    pending = set(task_index)
+    while num_finished < len(items):
+        done, pending = wait(pending)
+        pending = set(pending)
+        for future in done:
+            i = task_index[future]
+            if finished[i]:
+                continue
+            try:
+                results[i] = future.result()
+            except Exception:
+                if any(other in pending for other in tasks[i]):
+                    continue  # the other attempt may still succeed
+                raise
+            finished[i] = True
+            num_finished += 1
+            for other in tasks[i]:
+                if other is not future and other in pending:
+                    pending.discard(other)
+                    if hasattr(other, "cancel"):
+                        other.cancel()
+        if num_finished >= speculation_fraction * len(items):
+            for i, futures in enumerate(tasks):
+                # only back up tasks that have started, not ones waiting for a worker
+                if (
+                    not finished[i]
+                    and len(futures) == 1
+                    and getattr(futures[0], "running", lambda: True)()
+                ):
+                    backup = submit(func, items[i])
+                    futures.append(backup)
+                    task_index[backup] = i
+                    pending.add(backup)
+    return results, tasks
+
+
+class SpeculativeExecutor(object):
+    """
+    An executor that wraps a concurrent.futures.Executor, and runs backup tasks for stragglers (see
+    speculative_map), so that a few slow tasks don't hold up a whole job.
+    """
+
+    def __init__(self, executor, speculation_fraction=0.9):
+        self.executor = executor
+        self.speculation_fraction = speculation_fraction
+
+    def map(self, func, *iterables):
+        results, _ = speculative_map(
+            lambda f, args: self.executor.submit(f, *args),
+            lambda futures: concurrent.futures.wait(
+                futures, return_when=concurrent.futures.FIRST_COMPLETED
+            ),
+            func,
+            list(zip(*iterables)),
+            self.speculation_fraction,
+        )
+        return iter(results)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
+
+
+class _Batch(object):
+    """Apply a function to each set of arguments in a batch, and time the batch."""
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, batch):
+        start = time.time()
+        results = [self.func(*args) for args in batch]
+        return results, time.time() - start
+
+
+class BatchingExecutor(object):
+    """
+    An executor that runs a contiguous batch of partitions in each task of the executor it wraps, rather than a
+    single partition, to reduce per-task overheads (such as the invocation and cold start of a Pywren task) when
+    partitions are small. Results are still returned for each partition, in order.
+
+    The number of partitions in a task is partitions_per_task, unless target_task_duration (in seconds) is set,
+    in which case it is chosen so that tasks take about that long, using the time per partition measured in the
+    previous job.
+    """
+
+    def __init__(self, executor, partitions_per_task=1, target_task_duration=None):
+        assert partitions_per_task >= 1
+        self.executor = executor
+        self.partitions_per_task = partitions_per_task
+        self.target_task_duration = target_task_duration
+        self.seconds_per_partition = None
+
+    def batch_size(self):
+        """The number of partitions to run in each task of the next job."""
+        if self.target_task_duration is None or self.seconds_per_partition is None:
+            return self.partitions_per_task
+        if self.seconds_per_partition == 0:
+            return self.partitions_per_task
+        return max(1, int(self.target_task_duration / self.seconds_per_partition))
+
+    def map(self, func, *iterables):
+        items = list(zip(*iterables))
+        size = self.batch_size()
+        batches = [items[i : i + size] for i in range(0, len(items), size)]
+        batch_results = self.executor.map(_Batch(func), batches)
+
+        def results():
+            elapsed = 0.0
+            for batch, batch_elapsed in batch_results:
+                elapsed += batch_elapsed
+                for result in batch:
+                    yield result
+            if len(items) > 0:
+                self.seconds_per_partition = elapsed / len(items)
+
+        return results()
+
+    def shutdown(self, wait=True):
+        if hasattr(self.executor, "shutdown"):
+            self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
+
+
+class _Attempt(object):
+    """Call a function, returning whether it succeeded, and its result or the exception it raised."""
+
+    def __init__(self, func, retry_on):
+        self.func = func
+        self.retry_on = retry_on
+
+    def __call__(self, args):
+        try:
+            return True, self.func(*args)
+        except self.retry_on as e:
+            return False, e
+
+
+# The exceptions that RetryingExecutor retries by default: I/O errors (including socket timeouts, and throttling
+# errors from object stores), and the timeout raised for a future that doesn't finish in time. Other exceptions
+# are usually bugs, which would fail again.
+TRANSIENT_ERRORS = (IOError, OSError, concurrent.futures.TimeoutError)
+
+
+class RetryingExecutor(object):
+    """
+    An executor that retries the failed tasks of a job on the executor it wraps, rather than failing the whole job.
+    Only the failed tasks are resubmitted, and the results of the tasks that succeeded are kept (so chunks that
+    have already been written are not written again). Retries wait backoff * backoff_multiplier ** (attempt - 1)
+    seconds, and the last exception is raised if a task fails max_attempts times. The failures of the last job are
+    recorded in failures, as (task index, attempt, exception) tuples.
+
+    Exceptions of the types in retry_on (TRANSIENT_ERRORS by default) are retried. If the wrapped executor has a
+    submit method, they are caught when getting the result of each task's future, so failures that happen outside
+    the task (such as a task timing out) are retried too; otherwise they are caught in the task.
+    """
+
+    def __init__(
+        self,
+        executor,
+        max_attempts=3,
+        backoff=1.0,
+        backoff_multiplier=2.0,
+        retry_on=TRANSIENT_ERRORS,
+    ):
+        assert max_attempts >= 1
+        self.executor = executor
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_multiplier = backoff_multiplier
+        self.retry_on = retry_on
+        self.failures = []
+
+    def _attempt(self, func, items):
+        """Run func on each of items, returning (succeeded, result or exception) for each."""
+        if not hasattr(self.executor, "submit"):
+            return self.executor.map(_Attempt(func, self.retry_on), items)
+        futures = [self.executor.submit(func, *args) for args in items]
+        outcomes = []
+        try:
+            for future in futures:
+                try:
+                    outcomes.append((True, future.result()))
+                except self.retry_on as e:
+                    outcomes.append((False, e))
+        finally:
+            for future in futures:
+                future.cancel()
+        return outcomes
+
+    def map(self, func, *iterables):
+        items = list(zip(*iterables))
+        results = [None] * len(items)
+        remaining = list(range(len(items)))
+        self.failures = []
+        attempt = 1
+        while True:
+            outcomes = self._attempt(func, [items[i] for i in remaining])
+            failed = []
+            for i, (succeeded, value) in zip(remaining, outcomes):
+                if succeeded:
+                    results[i] = value
+                else:
+                    failed.append(i)
+                    self.failures.append((i, attempt, value))
+            if len(failed) == 0:
+                return iter(results)
+            if attempt >= self.max_attempts:
+                raise self.failures[-1][2]
+            time.sleep(self.backoff * self.backoff_multiplier ** (attempt - 1))
+            remaining = failed
+            attempt += 1
+
+    def shutdown(self, wait=True):
+        if hasattr(self.executor, "shutdown"):
+            self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
+
+
+def _func_name(func):
+    """A short description of a task function; for a DAG program, the functions that compute its outputs."""
+    if isinstance(func, MergedProgram):
+        return ",".join(_func_name(program) for program in func.programs)
+    elif isinstance(func, Program):
+        slot_funcs = {out: f for f, _, out, _, _ in func.instructions}
+        return ",".join(
+            _func_name(slot_funcs[slot]) if slot in slot_funcs else "input"
+            for slot in func.output_slots
+        )
+    elif isinstance(func, (_Attempt, _Batch, _Serialized)):
+        return _func_name(func.func)
+    elif hasattr(func, "func"):  # functools.partial
+        return _func_name(func.func)
+    return getattr(func, "__qualname__", getattr(func, "__name__", type(func).__name__))
+
+
+def _nbytes(value):
+    if value is None:
+        return 0
+    elif hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    elif isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class _Instrumented(object):
+    """Call a function, and return its result (or exception) with a record of the call."""
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, args):
+        reset_io_counters()
+        record = {
+            "worker": "%s-%s" % (os.getpid(), threading.current_thread().name),
+            "started": time.time(),
+        }
+        result = exception = None
+        try:
+            result = self.func(*args)
+        except Exception as e:
+            exception = e
+        record["finished"] = time.time()
+        record["bytes_read"], record["bytes_written"] = get_io_counters()
+        record["result_bytes"] = _nbytes(result)
+        record["exception"] = None if exception is None else repr(exception)
+        return result, exception, record
+
+
+class InstrumentedExecutor(object):
+    """
+    An executor that records metrics for every task run by the executor it wraps, and writes them to log_path as
+    JSON lines (one object per task). The default log path is a new file in ~/.zappy/logs.
+
+    Each record has the job number, the task index in the job (the partition index, for DAG jobs), the DAG nodes
+    computed by the task, the worker (process and thread) that ran it, the times the job was submitted and the task
+    started and finished, the number of bytes that the task read from and wrote to stores, the size of its result,
+    and the exception it raised, if any. Times are seconds since the epoch.
+    """
+
+    def __init__(self, executor, log_path=None):
+        self.executor = executor
+        if log_path is None:
+            logs_dir = os.path.expanduser("~/.zappy/logs")
+            os.makedirs(logs_dir, exist_ok=True)
+            timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S.%f")
+            log_path = os.path.join(logs_dir, "tasks-{}.jsonl".format(timestamp))
+        self.log_path = log_path
+        self.num_jobs = 0
+        self.records = []  # records for the last job
+
+    def map(self, func, *iterables):
+        job = self.num_jobs
+        self.num_jobs += 1
+        name = _func_name(func)
+        submitted = time.time()
+        outcomes = list(self.executor.map(_Instrumented(func), list(zip(*iterables))))
+        self.records = []
+        for index, (_, _, record) in enumerate(outcomes):
+            record.update(job=job, task=index, node=name, submitted=submitted)
+            self.records.append(record)
+        with open(self.log_path, "a") as file:
+            for record in self.records:
+                file.write(json.dumps(record, sort_keys=True) + "\n")
+        for _, exception, _ in outcomes:
+            if exception is not None:
+                raise exception
+        return iter([result for result, _, _ in outcomes])
+
+    def shutdown(self, wait=True):
+        if hasattr(self.executor, "shutdown"):
+            self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
+
+
+class _Serialized(object):
+    """Call a function on serialized arguments, and return its result serialized."""
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, data):
+        return serialization.dumps(self.func(*serialization.loads(data)))
+
+
+class SerializingExecutor(object):
+    """
+    An executor that serializes the arguments and results of tasks run by the executor it wraps (such as a
+    ProcessPoolExecutor) with zappy.serialization, so that array chunks are sent as single bytes objects, with
+    one copy of their data, rather than being pickled in-band. Arrays in the arguments and results are read-only.
+    """
+
+    def __init__(self, executor):
+        self.executor = executor
+
+    def map(self, func, *iterables):
+        payloads = [serialization.dumps(args) for args in zip(*iterables)]
+        results = self.executor.map(_Serialized(func), payloads)
+
+        def deserialized():
+            for data in results:
+                yield serialization.loads(data)
+
+        return deserialized()
+
+    def shutdown(self, wait=True):
+        if hasattr(self.executor, "shutdown"):
+            self.executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
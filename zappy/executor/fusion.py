@@ -0,0 +1,265 @@
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:  # numexpr is optional
+    numexpr = None
+
+from zappy.executor.dag import Input, LazyVal
+
+# Expressions are nested tuples, so that identical subexpressions compare (and hash) equal and are only evaluated
+# once. An expression is one of:
+# * ("arg", i) - the i-th argument of the kernel (a chunk, or a co-partitioned side input)
+# * ("const", i) - the i-th constant of the kernel (a scalar or a row to broadcast)
+# * (ufunc, expr, ...) - a ufunc applied to other expressions
+
+# The maximum number of ufuncs fused into one kernel, which bounds the recursion depth of evaluating it
+MAX_FUSED_OPS = 32
+
+# The number of bytes in a tile of output rows when evaluating without numexpr, so that the temporaries for a
+# tile stay in cache
+TILE_BYTES = 256 * 1024
+
+_NUMEXPR_BINARY_OPS = {
+    "add": "({} + {})",
+    "subtract": "({} - {})",
+    "multiply": "({} * {})",
+    "true_divide": "({} / {})",
+    "divide": "({} / {})",
+    "power": "({} ** {})",
+    "greater": "({} > {})",
+    "greater_equal": "({} >= {})",
+    "less": "({} < {})",
+    "less_equal": "({} <= {})",
+    "equal": "({} == {})",
+    "not_equal": "({} != {})",
+    "arctan2": "arctan2({}, {})",
+}
+
+_COMPARISON_OPS = (
+    "greater",
+    "greater_equal",
+    "less",
+    "less_equal",
+    "equal",
+    "not_equal",
+)
+
+_NUMEXPR_UNARY_OPS = {
+    "negative": "(-{})",
+    "absolute": "abs({})",
+    "log": "log({})",
+    "log10": "log10({})",
+    "log1p": "log1p({})",
+    "exp": "exp({})",
+    "expm1": "expm1({})",
+    "sqrt": "sqrt({})",
+    "sin": "sin({})",
+    "cos": "cos({})",
+    "tan": "tan({})",
+    "arcsin": "arcsin({})",
+    "arccos": "arccos({})",
+    "arctan": "arctan({})",
+    "sinh": "sinh({})",
+    "cosh": "cosh({})",
+    "tanh": "tanh({})",
+}
+
+
+class ElementwiseKernel(object):
+    """A function that applies a tree of elementwise ufuncs to chunks in a single pass.
+
+    Without numexpr, the output is preallocated and the tree is evaluated over tiles of rows, so the
+    temporaries for intermediate results are tile-sized rather than chunk-sized. The output is written to the
+    buffer passed as out if it has the right shape and dtype (it may be one of the arguments).
+    """
+
+    reuses_buffers = True
+    owns_result = True
+
+    def __init__(self, expr, consts, num_args):
+        self.expr = expr
+        self.consts = consts
+        self.num_args = num_args
+        self.num_ops = _count_ops(expr)
+
+    def __call__(self, *args, **kwargs):
+        out = kwargs.get("out")
+        if self._can_use_numexpr(args):
+            return self._evaluate_numexpr(args, out)
+        return self._evaluate_tiled(args, out)
+
+    def _can_use_numexpr(self, args):
+        # numexpr's casting rules differ from NumPy's for other types, so stick to float64 data
+        return (
+            numexpr is not None
+            and all(np.asarray(arg).dtype == np.float64 for arg in args)
+            and all(
+                const.dtype.kind in "if" and const.dtype.itemsize == 8
+                for const in self.consts
+            )
+            and all(
+                op.__name__ in _NUMEXPR_BINARY_OPS or op.__name__ in _NUMEXPR_UNARY_OPS
+                for op in _ops(self.expr)
+            )
+        )
+
+    def _evaluate_numexpr(self, args, out=None):
+        local_dict = {"a%s" % i: arg for i, arg in enumerate(args)}
+        local_dict.update({"c%s" % i: const for i, const in enumerate(self.consts)})
+        if (
+            out is not None
+            and _can_write_to(out, args)
+            and self.expr[0].__name__ not in _COMPARISON_OPS
+            and out.dtype == np.float64
+            and out.shape == np.broadcast(*local_dict.values()).shape
+        ):
+            return numexpr.evaluate(
+                _numexpr_string(self.expr), local_dict=local_dict, out=out
+            )
+        return numexpr.evaluate(_numexpr_string(self.expr), local_dict=local_dict)
+
+    def _evaluate_tiled(self, args, out=None):
+        leaves = list(args) + list(self.consts)
+        try:
+            shape = np.broadcast(*leaves).shape
+        except ValueError:  # too many leaves for np.broadcast
+            return _evaluate(self.expr, args, self.consts, {})
+        if (
+            len(shape) == 0
+            or shape[0] == 0
+            or not all(_row_tileable(leaf, shape) for leaf in leaves)
+        ):
+            return _evaluate(self.expr, args, self.consts, {})
+        row_size = int(np.prod(shape[1:]))
+        result = None
+        start = 0
+        while start < shape[0]:
+            if result is None:
+                stop = min(shape[0], start + 1)  # find the result dtype from one row
+            else:
+                stop = min(
+                    shape[0],
+                    start + max(1, TILE_BYTES // max(1, result.itemsize * row_size)),
+                )
+            tile_args = [_row_tile(arg, shape, start, stop) for arg in args]
+            tile_consts = [
+                _row_tile(const, shape, start, stop) for const in self.consts
+            ]
+            tile = _evaluate(self.expr, tile_args, tile_consts, {})
+            if result is None:
+                if (
+                    out is not None
+                    and out.shape == shape
+                    and out.dtype == tile.dtype
+                    and _can_write_to(out, args)
+                ):
+                    result = out  # safe even if out is an argument, since each tile is only read once
+                else:
+                    result = np.empty(shape, dtype=tile.dtype)
+            result[start:stop] = tile
+            start = stop
+        return result
+
+
+def _can_write_to(out, args):
+    """Whether a result can be written into out: no argument other than out itself overlaps it, such as a reversed
+    view of it, whose elements would be overwritten before they are read."""
+    return not any(
+        isinstance(arg, np.ndarray) and arg is not out and np.shares_memory(arg, out)
+        for arg in args
+    )
+
+
+def fuse(ufunc, operands):
+    """Return a kernel and DAG inputs for applying a ufunc to operands.
+
+    Operands are DAG nodes (chunks or side inputs) or constants. Operands that are themselves computed by a kernel
+    are inlined into the new kernel, as long as it doesn't grow beyond MAX_FUSED_OPS.
+    """
+    inputs = []
+    consts = []
+
+    def arg(node):
+        for i, existing in enumerate(inputs):
+            if existing is node:
+                return ("arg", i)
+        inputs.append(node)
+        return ("arg", len(inputs) - 1)
+
+    def const(value):
+        for i, existing in enumerate(consts):
+            if existing is value:
+                return ("const", i)
+        consts.append(value)
+        return ("const", len(consts) - 1)
+
+    exprs = []
+    num_ops = 1
+    for operand in operands:
+        if isinstance(operand, LazyVal) and isinstance(operand.func, ElementwiseKernel):
+            kernel = operand.func
+            if num_ops + kernel.num_ops <= MAX_FUSED_OPS:
+                num_ops += kernel.num_ops
+                args = [arg(node) for node in operand.inputs]
+                kernel_consts = [const(value) for value in kernel.consts]
+                exprs.append(_substitute(kernel.expr, args, kernel_consts))
+                continue
+        if isinstance(operand, (Input, LazyVal)):
+            exprs.append(arg(operand))
+        else:
+            exprs.append(const(np.asarray(operand)))
+    return ElementwiseKernel((ufunc,) + tuple(exprs), consts, len(inputs)), inputs
+
+
+def _substitute(expr, args, consts):
+    if expr[0] == "arg":
+        return args[expr[1]]
+    elif expr[0] == "const":
+        return consts[expr[1]]
+    return (expr[0],) + tuple(_substitute(e, args, consts) for e in expr[1:])
+
+
+def _ops(expr):
+    if expr[0] in ("arg", "const"):
+        return []
+    return [expr[0]] + [op for e in expr[1:] for op in _ops(e)]
+
+
+def _count_ops(expr):
+    return len(_ops(expr))
+
+
+def _evaluate(expr, args, consts, memo):
+    if expr[0] == "arg":
+        return args[expr[1]]
+    elif expr[0] == "const":
+        return consts[expr[1]]
+    if expr not in memo:
+        memo[expr] = expr[0](*[_evaluate(e, args, consts, memo) for e in expr[1:]])
+    return memo[expr]
+
+
+def _numexpr_string(expr):
+    if expr[0] == "arg":
+        return "a%s" % expr[1]
+    elif expr[0] == "const":
+        return "c%s" % expr[1]
+    name = expr[0].__name__
+    operands = [_numexpr_string(e) for e in expr[1:]]
+    if name in _NUMEXPR_BINARY_OPS and len(operands) == 2:
+        return _NUMEXPR_BINARY_OPS[name].format(*operands)
+    return _NUMEXPR_UNARY_OPS[name].format(*operands)
+
+
+def _row_tileable(leaf, shape):
+    # a leaf can be split into row tiles if it has a row for every output row, or is broadcast along rows
+    leaf_shape = np.shape(leaf)
+    return len(leaf_shape) < len(shape) or leaf_shape[0] in (1, shape[0])
+
+
+def _row_tile(leaf, shape, start, stop):
+    leaf_shape = np.shape(leaf)
+    if len(leaf_shape) < len(shape) or leaf_shape[0] != shape[0]:
+        return leaf  # broadcast along rows
+    return leaf[start:stop]
@@ -0,0 +1,54 @@
+import numpy as np
+
+# Estimates of the peak memory used by a task, so that chunk sizes can be chosen to fit in the memory of a worker
+# (such as an AWS Lambda function) rather than found by running jobs that fail.
+#
+# Values computed by a task are assumed to be chunk-sized, with the dtype of the array: this over-estimates
+# reductions and under-estimates dtypes that widen (such as int8 to float64), but chunk-sized values dominate the
+# memory of most tasks. Partition inputs (chunk indices, row ranges) are assumed to be small.
+
+
+def live_chunks(program):
+    """
+    Return the greatest number of chunk-sized values that are held at once when a Program is evaluated for a
+    partition. Values are released after their last use, and results written into a released buffer don't
+    allocate, as in Program.__call__. Each output counts once more, for the copy made when it is serialized.
+    """
+    live = set()
+    peak = 0
+    for _, _, out, release, reuse in program.instructions:
+        if reuse is None:
+            peak = max(peak, len(live) + 1)
+        live.add(out)
+        live.difference_update(release)
+    return peak + len(program.output_slots)
+
+
+def estimate_task_memory(chunks, dtype, num_live_chunks):
+    """
+    Return the estimated peak number of bytes used by a task holding num_live_chunks chunks of the given shape and
+    dtype at once.
+    """
+    return int(np.prod(chunks)) * np.dtype(dtype).itemsize * num_live_chunks
+
+
+def fit_row_chunks(shape, dtype, max_task_memory, num_live_chunks, multiple_of=1):
+    """
+    Return the greatest number of rows in a chunk of the full width of an array of the given shape and dtype, such
+    that a task holding num_live_chunks chunks fits in max_task_memory bytes. The number of rows is a multiple of
+    multiple_of (such as the number of rows in a chunk of a Zarr file being read), and at most the number of rows
+    in the array.
+
+    :raise ValueError: if not even multiple_of rows fit
+    """
+    row_bytes = estimate_task_memory(shape[1:], dtype, num_live_chunks)
+    rows = max_task_memory // row_bytes if row_bytes > 0 else shape[0]
+    rows = min(rows, shape[0])
+    if rows < multiple_of and rows < shape[0]:
+        raise ValueError(
+            "Chunks of %s rows need an estimated %s bytes per task, more than max_task_memory of %s bytes"
+            % (multiple_of, multiple_of * row_bytes, max_task_memory)
+        )
+    if rows < shape[0]:
+        rows -= rows % multiple_of
+    return max(1, rows)
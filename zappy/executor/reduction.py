@@ -0,0 +1,148 @@
+import numpy as np
+
+from functools import partial
+
+from zappy.zarr_util import (
+    delete_values,
+    load_value,
+    open_store,
+    store_location,
+    store_value,
+)
+
+# Reductions compute a partial result for each partition, combine any number of partial results (in partition
+# order) into one, and finally turn the combined partial result into the result.
+
+
+class DistributiveReduction(object):
+    """A reduction where f(a, b, c, d) = f(f(a, b), f(c, d)), such as sum or min."""
+
+    def __init__(self, func, axis):
+        self.func = func
+        self.axis = axis
+
+    def partial(self, chunk, row_offset):
+        return self.func(chunk, axis=self.axis)
+
+    def combine(self, partials):
+        return self.func(partials, axis=self.axis)
+
+    def finalize(self, partial):
+        return partial
+
+
+class ArgReduction(object):
+    """An argmin or argmax reduction, whose partial results are (value, index) pairs."""
+
+    def __init__(self, func, axis):
+        self.func = func
+        self.axis = axis
+
+    def partial(self, chunk, row_offset):
+        if chunk.shape[0] == 0:
+            return None
+        index = self.func(chunk, axis=self.axis)
+        if self.axis is None:  # index into the flattened array
+            row_size = int(np.prod(chunk.shape[1:]))
+            return chunk.flat[index], index + row_offset * row_size
+        return chunk[index, np.arange(chunk.shape[1])], index + row_offset
+
+    def combine(self, partials):
+        partials = [p for p in partials if p is not None]
+        if len(partials) == 0:
+            return None
+        values = np.array([p[0] for p in partials])
+        indices = np.array([p[1] for p in partials])
+        # ties go to the first partial, which has the lowest index
+        best = self.func(values, axis=0)
+        if self.axis is None:
+            return values[best], indices[best]
+        columns = np.arange(values.shape[1])
+        return values[best, columns], indices[best, columns]
+
+    def finalize(self, partial):
+        return partial[1]
+
+
+class MeanReduction(object):
+    """A mean, whose partial results are (count, sum) pairs."""
+
+    def __init__(self, axis):
+        self.axis = axis
+
+    def partial(self, chunk, row_offset):
+        if self.axis is None:
+            count = chunk.shape[0] * chunk.shape[1]
+        else:
+            count = chunk.shape[0]
+        return count, np.sum(chunk, axis=self.axis)
+
+    def combine(self, partials):
+        total_count = sum([p[0] for p in partials])
+        return total_count, np.sum([p[1] for p in partials], axis=self.axis)
+
+    def finalize(self, partial):
+        total_count, total = partial
+        return total / total_count
+
+
+def _partial_key(prefix, level, index):
+    return "%s/%s/%s" % (prefix, level, index)
+
+
+def write_partial(location, prefix, reduction, index, chunk, row_offset):
+    """
+    Compute the partial result for a partition and write it to the store at location (see store_location), as the
+    first level of a tree.
+    """
+    store_value(
+        open_store(location),
+        _partial_key(prefix, 0, index),
+        reduction.partial(chunk, row_offset),
+    )
+
+
+def _combine_partials(location, prefix, reduction, group):
+    level, index, partial_indices, final = group
+    store = open_store(location)
+    combined = reduction.combine(
+        [load_value(store, _partial_key(prefix, level, i)) for i in partial_indices]
+    )
+    if final:
+        return combined
+    store_value(store, _partial_key(prefix, level + 1, index), combined)
+
+
+def tree_reduce(executor, reduction, store, prefix, num_partials, fan_in):
+    """
+    Combine partial results that have been written to the store by write_partial, using a tree of executor tasks
+    that each combine up to fan_in partial results. Intermediate partial results are stored for the next level of
+    the tree, and only the final partial result is returned to the driver.
+    """
+    assert fan_in > 1
+    location = store_location(store)
+    level = 0
+    try:
+        while True:
+            starts = range(0, num_partials, fan_in)
+            final = len(starts) == 1
+            groups = [
+                (
+                    level,
+                    index,
+                    list(range(start, min(start + fan_in, num_partials))),
+                    final,
+                )
+                for index, start in enumerate(starts)
+            ]
+            results = list(
+                executor.map(
+                    partial(_combine_partials, location, prefix, reduction), groups
+                )
+            )
+            if final:
+                return results[0]
+            level += 1
+            num_partials = len(groups)
+    finally:
+        delete_values(store, prefix)
@@ -0,0 +1,160 @@
+import concurrent.futures
+import pickle
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+try:
+    import cloudpickle
+except ImportError:  # cloudpickle is optional, but needed for lambdas
+    cloudpickle = None
+
+
+class SharedArray(object):
+    """A reference to an ndarray in a shared memory block, which is what gets pickled instead of the data."""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+
+def _untrack(block):
+    # Blocks are unlinked by the driver, so workers must not track them, or the resource tracker would try to
+    # unlink them again (see https://bugs.python.org/issue39959)
+    resource_tracker.unregister(block._name, "shared_memory")
+
+
+def _to_shared(value, blocks, in_worker=False):
+    """
+    Return value with any ndarrays in it (including in tuples and lists) replaced by references to copies in new
+    shared memory blocks, which are appended to blocks.
+    """
+    if isinstance(value, np.ndarray) and value.dtype.kind != "O" and value.nbytes > 0:
+        block = shared_memory.SharedMemory(create=True, size=value.nbytes)
+        if in_worker:
+            _untrack(block)
+        blocks.append(block)
+        np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf)[...] = value
+        return SharedArray(block.name, value.shape, value.dtype)
+    elif isinstance(value, tuple):
+        return tuple(_to_shared(v, blocks, in_worker) for v in value)
+    elif isinstance(value, list):
+        return [_to_shared(v, blocks, in_worker) for v in value]
+    return value
+
+
+def _from_shared(value, blocks, in_worker=False):
+    """
+    Return value with any references to shared arrays replaced by ndarrays, and the shared memory blocks appended
+    to blocks. In workers the ndarrays are views of the blocks; on the driver they are copies, so the blocks can be
+    freed.
+    """
+    if isinstance(value, SharedArray):
+        block = shared_memory.SharedMemory(name=value.name)
+        if in_worker:
+            _untrack(block)
+        blocks.append(block)
+        arr = np.ndarray(value.shape, dtype=value.dtype, buffer=block.buf)
+        return arr if in_worker else arr.copy()
+    elif isinstance(value, tuple):
+        return tuple(_from_shared(v, blocks, in_worker) for v in value)
+    elif isinstance(value, list):
+        return [_from_shared(v, blocks, in_worker) for v in value]
+    return value
+
+
+def _close(blocks, unlink=False):
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            pass  # a view is still referenced (e.g. by a cache), so the mapping is freed with it
+        if unlink:
+            block.unlink()
+
+
+def _run_task(func_bytes, shared_args):
+    # runs in a worker process
+    func = pickle.loads(func_bytes)
+    input_blocks = []
+    args = _from_shared(shared_args, input_blocks, in_worker=True)
+    try:
+        result = func(*args)
+        result_blocks = []
+        shared_result = _to_shared(result, result_blocks, in_worker=True)
+        _close(result_blocks)  # the driver unlinks them once it has read the result
+        return shared_result
+    finally:
+        args = result = None
+        _close(input_blocks)
+
+
+class SharedMemoryExecutor(object):
+    """
+    An executor that runs tasks in a pool of local processes, so that pure Python work is not limited by the GIL.
+    Unlike a ProcessPoolExecutor, ndarrays in the arguments and results of tasks are not pickled: they are copied
+    into shared memory blocks, and only references to the blocks are passed between processes. Workers read the
+    arguments as views of the blocks without copying them, and results are copied once on the driver, before their
+    blocks are freed.
+
+    Functions are pickled with cloudpickle if it is installed, so they may be lambdas.
+    """
+
+    def __init__(self, max_workers=None):
+        if shared_memory is None:
+            raise NotImplementedError("SharedMemoryExecutor needs Python 3.8 or later")
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+
+    @staticmethod
+    def _dumps(func):
+        if cloudpickle is not None:
+            return cloudpickle.dumps(func)
+        return pickle.dumps(func)
+
+    def _submit(self, func_bytes, args):
+        input_blocks = []
+        shared_args = _to_shared(args, input_blocks)
+        future = concurrent.futures.Future()
+
+        def done(task_future):
+            _close(input_blocks, unlink=True)
+            result_blocks = []
+            try:
+                result = _from_shared(task_future.result(), result_blocks)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            finally:
+                _close(result_blocks, unlink=True)
+
+        self.pool.submit(_run_task, func_bytes, shared_args).add_done_callback(done)
+        return future
+
+    def submit(self, func, *args):
+        return self._submit(self._dumps(func), args)
+
+    def map(self, func, *iterables):
+        func_bytes = self._dumps(func)
+        futures = [self._submit(func_bytes, args) for args in zip(*iterables)]
+
+        def results():
+            for future in futures:
+                yield future.result()
+
+        return results()
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
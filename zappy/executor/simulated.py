@@ -0,0 +1,254 @@
+import concurrent.futures
+import datetime
+import heapq
+import os
+import pickle
+import time
+
+try:
+    import cloudpickle
+except ImportError:  # cloudpickle is optional, but needed for lambdas
+    cloudpickle = None
+
+
+class SimulatedOutOfMemoryError(MemoryError):
+    """Raised by a simulated task that uses more memory than the memory limit."""
+
+
+class SimulatedInvocation(object):
+    """
+    The record of a simulated task, with the same invoke_status and run_status fields as a Pywren future, so that
+    it can be analyzed with the scripts in pywren-scripts. Times are simulated seconds since the executor started.
+    """
+
+    def __init__(self, invoke_status, run_status, func_size):
+        self.invoke_status = invoke_status
+        self.run_status = run_status
+        self._invoke_metadata = {"func_module_str_len": func_size}
+
+
+class SimulatedFuture(concurrent.futures.Future):
+    """A future for a simulated task. Getting its result advances the driver's simulated clock."""
+
+    def __init__(self, executor, invocation):
+        super(SimulatedFuture, self).__init__()
+        self._executor = executor
+        self.invocation = invocation
+        self.invoke_status = invocation.invoke_status
+        self.run_status = invocation.run_status
+
+    def result(self, timeout=None):
+        self._executor._observe(self.run_status["download_output_timestamp"])
+        return super(SimulatedFuture, self).result(timeout)
+
+    def exception(self, timeout=None):
+        self._executor._observe(self.run_status["download_output_timestamp"])
+        return super(SimulatedFuture, self).exception(timeout)
+
+
+class SimulatedServerlessExecutor(object):
+    """
+    An executor that simulates a serverless platform like AWS Lambda with Pywren, for benchmarking scheduling and
+    chunk sizes without a cloud account. Each task is run for real, in the calling thread, and its duration is
+    measured; the platform around it is simulated with a clock, so a job of thousands of tasks takes about as long
+    as running its tasks one after another, but its simulated times are what they would be on the platform:
+
+    * The driver uploads the function once per job, and the arguments of each task, at upload_bandwidth bytes per
+      second, then invokes the task, which takes invocation_overhead seconds. Uploads and invocations are serial.
+    * At most max_concurrency tasks run at once, and later tasks wait for a container to be free. A task run in a
+      new container, or one that has been idle for more than warm_timeout seconds, first takes cold_start seconds.
+    * A task runs for its measured duration multiplied by compute_scale, and its result is downloaded at
+      download_bandwidth bytes per second. The driver's clock moves on when it gets the result of a task.
+    * If memory_limit is set, a task whose peak memory (runtime_memory, plus the memory allocated while
+      unpickling its arguments and running it, as measured by tracemalloc) exceeds it fails with
+      SimulatedOutOfMemoryError.
+
+    Functions, arguments and results are pickled (functions with cloudpickle, if it is installed), as they would be
+    for Pywren. Every task is recorded in invocations, and if record_job_history is set then each job is written to
+    ~/.zappy/logs in the same format as PywrenExecutor, so pywren-scripts/analyze.py can plot it.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=1000,
+        cold_start=1.0,
+        warm_timeout=600.0,
+        invocation_overhead=0.01,
+        upload_bandwidth=None,
+        download_bandwidth=None,
+        compute_scale=1.0,
+        memory_limit=None,
+        runtime_memory=0,
+        record_job_history=False,
+    ):
+        assert max_concurrency >= 1
+        self.max_concurrency = max_concurrency
+        self.cold_start = cold_start
+        self.warm_timeout = warm_timeout
+        self.invocation_overhead = invocation_overhead
+        self.upload_bandwidth = upload_bandwidth
+        self.download_bandwidth = download_bandwidth
+        self.compute_scale = compute_scale
+        self.memory_limit = memory_limit
+        self.runtime_memory = runtime_memory
+        self.record_job_history = record_job_history
+        self.clock = 0.0  # the driver's simulated time
+        self.invocations = []
+        self._containers = []  # heap of (time the container is free, container id)
+        self._num_containers = 0
+
+    def _observe(self, timestamp):
+        self.clock = max(self.clock, timestamp)
+
+    @staticmethod
+    def _dumps(func):
+        if cloudpickle is not None:
+            return cloudpickle.dumps(func)
+        return pickle.dumps(func)
+
+    def _transfer_time(self, nbytes, bandwidth):
+        return 0.0 if bandwidth is None else nbytes / float(bandwidth)
+
+    def _upload_func(self, func):
+        func_bytes = self._dumps(func)
+        upload_time = self._transfer_time(len(func_bytes), self.upload_bandwidth)
+        self.clock += upload_time
+        return func_bytes, upload_time, self.clock
+
+    def _container(self, arrival):
+        """Return the time a container is ready to run a task arriving at the given time, and if it is cold."""
+        # containers that have been idle for too long have been reclaimed
+        while self._containers and self._containers[0][0] + self.warm_timeout < arrival:
+            heapq.heappop(self._containers)
+            self._num_containers -= 1
+        idle = len(self._containers) > 0 and self._containers[0][0] <= arrival
+        if not idle and self._num_containers < self.max_concurrency:
+            self._num_containers += 1
+            return arrival, True
+        free_at, _ = heapq.heappop(self._containers)
+        return max(arrival, free_at), False
+
+    def _run(self, func_bytes, data):
+        if self.memory_limit is None:
+            start = time.perf_counter()
+            func = pickle.loads(func_bytes)
+            try:
+                return func(*pickle.loads(data)), None, time.perf_counter() - start, 0
+            except Exception as e:
+                return None, e, time.perf_counter() - start, 0
+        import tracemalloc  # Python 3 only, so only needed when memory_limit is set
+
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        else:  # Python < 3.9
+            tracemalloc.clear_traces()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        func = pickle.loads(func_bytes)
+        result = exception = None
+        try:
+            result = func(*pickle.loads(data))
+        except Exception as e:
+            exception = e
+        duration = time.perf_counter() - start
+        peak_memory = self.runtime_memory + tracemalloc.get_traced_memory()[1] - baseline
+        if not tracing:
+            tracemalloc.stop()
+        if exception is None and peak_memory > self.memory_limit:
+            result = None
+            exception = SimulatedOutOfMemoryError(
+                "Task used %s bytes, more than the memory limit of %s bytes"
+                % (peak_memory, self.memory_limit)
+            )
+        return result, exception, duration, peak_memory
+
+    def _submit(self, func_bytes, func_upload_time, func_upload_timestamp, args):
+        data = pickle.dumps(args, protocol=pickle.HIGHEST_PROTOCOL)
+        data_upload_time = self._transfer_time(len(data), self.upload_bandwidth)
+        self.clock += data_upload_time
+        data_upload_timestamp = self.clock
+        self.clock += self.invocation_overhead
+        host_submit_time = self.clock
+
+        result, exception, duration, peak_memory = self._run(func_bytes, data)
+        result_bytes = b""
+        if exception is None:
+            result_bytes = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+            result = pickle.loads(result_bytes)
+
+        start_time, cold = self._container(host_submit_time)
+        setup_time = self.cold_start if cold else 0.0
+        end_time = start_time + setup_time + duration * self.compute_scale
+        heapq.heappush(self._containers, (end_time, len(self.invocations)))
+        download_output_timestamp = end_time + self._transfer_time(
+            len(result_bytes), self.download_bandwidth
+        )
+
+        invoke_status = {
+            "host_submit_time": host_submit_time,
+            "data_upload_time": data_upload_time,
+            "data_upload_timestamp": data_upload_timestamp,
+            "func_upload_time": func_upload_time,
+            "func_upload_timestamp": func_upload_timestamp,
+            "data_size_bytes": len(data),
+        }
+        run_status = {
+            "host_submit_time": host_submit_time,
+            "start_time": start_time,
+            "setup_time": setup_time,
+            "end_time": end_time,
+            "download_output_timestamp": download_output_timestamp,
+            "cold_start": cold,
+            "peak_memory": peak_memory,
+            "result_size_bytes": len(result_bytes),
+            "exception": None if exception is None else repr(exception),
+        }
+        invocation = SimulatedInvocation(invoke_status, run_status, len(func_bytes))
+        self.invocations.append(invocation)
+        future = SimulatedFuture(self, invocation)
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+        return future
+
+    def submit(self, func, *args):
+        return self._submit(*self._upload_func(func), args=args)
+
+    def map(self, func, *iterables):
+        func_upload = self._upload_func(func)
+        futures = [self._submit(*func_upload, args=args) for args in zip(*iterables)]
+        if self.record_job_history:
+            self._record_job(futures)
+
+        def results():
+            for future in futures:
+                yield future.result()
+
+        return results()
+
+    def _record_job(self, futures):
+        outdict = {
+            "futures": [future.invocation for future in futures],
+            "run_statuses": [future.run_status for future in futures],
+            "invoke_statuses": [future.invoke_status for future in futures],
+        }
+        logs_dir = os.path.expanduser("~/.zappy/logs")
+        os.makedirs(logs_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S.%f")
+        filename = os.path.join(logs_dir, "simulated-{}.pickle".format(timestamp))
+        with open(filename, "wb") as file:
+            pickle.dump(outdict, file)
+
+    def shutdown(self, wait=True):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(wait=True)
+        return False
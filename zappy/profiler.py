@@ -0,0 +1,101 @@
+import contextlib
+import functools
+import sys
+import threading
+import time
+
+import numpy as np
+
+# The profilers that are currently active, and the names of the operations in progress in each thread (outermost
+# first), since operations may be run concurrently from several threads
+_profilers = []
+_local = threading.local()
+
+
+def _operations():
+    if not hasattr(_local, "operations"):
+        _local.operations = []
+    return _local.operations
+
+
+class Profiler(object):
+    """
+    Wall time, and bytes of results returned to the driver, for each high-level ZappyArray operation. Operations
+    are keyed by their path: the names of the operations that they were called from, followed by their own name,
+    so implicit materializations (such as np.asarray(other) in a ufunc) show up under the operation that caused
+    them.
+    """
+
+    def __init__(self):
+        self.stats = {}  # path -> [calls, seconds, driver bytes]
+
+    def record(self, path, seconds, nbytes):
+        stats = self.stats.setdefault(path, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += nbytes
+
+    def report(self):
+        """Return a report of the operations, slowest first. Times include nested operations."""
+        lines = [
+            "%8s %10s %14s  %s" % ("calls", "seconds", "driver bytes", "operation")
+        ]
+        for path, (calls, seconds, nbytes) in sorted(
+            self.stats.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(
+                "%8d %10.3f %14d  %s" % (calls, seconds, nbytes, " > ".join(path))
+            )
+        return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def profile(file=None):
+    """
+    Profile the ZappyArray operations run on the driver in a with block, and write a report to file (stderr by
+    default) at the end of the block. The Profiler is the target of the with statement.
+    """
+    profiler = Profiler()
+    _profilers.append(profiler)
+    try:
+        yield profiler
+    finally:
+        _profilers.remove(profiler)
+        (file or sys.stderr).write(profiler.report() + "\n")
+
+
+def _nbytes(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.nbytes
+    elif isinstance(value, tuple):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+def profiled(name):
+    """
+    Decorator for an operation to profile. The name is a string, or a function of the operation's arguments that
+    returns the name.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if len(_profilers) == 0:
+                return func(*args, **kwargs)
+            operations = _operations()
+            operations.append(name if isinstance(name, str) else name(*args, **kwargs))
+            path = tuple(operations)
+            start = time.time()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                operations.pop()
+            elapsed = time.time() - start
+            for profiler in _profilers:
+                profiler.record(path, elapsed, _nbytes(result))
+            return result
+
+        return wrapper
+
+    return decorator
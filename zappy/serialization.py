@@ -0,0 +1,49 @@
+import pickle
+import struct
+
+# Serialization for values that contain large array chunks, using pickle protocol 5 (Python 3.8 or later) so
+# that the data of ndarrays is stored as out-of-band buffers. Serializing copies the data of each array once,
+# into the result, and deserializing doesn't copy it at all: the arrays are views of the serialized bytes (so
+# they are read-only if the bytes are immutable).
+#
+# The serialized form is a frame count, the length of each frame, and the frames: first the pickle stream, and
+# then the out-of-band buffers that it refers to.
+
+OUT_OF_BAND = pickle.HIGHEST_PROTOCOL >= 5
+
+
+def serialize(value):
+    """Return a list of frames (bytes-like objects) for a value, without copying the data of any ndarrays."""
+    if not OUT_OF_BAND:
+        return [pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)]
+    buffers = []
+    stream = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    return [stream] + [buffer.raw() for buffer in buffers]
+
+
+def deserialize(frames):
+    """Return the value for a list of frames returned by serialize."""
+    if len(frames) == 1:
+        return pickle.loads(frames[0])
+    return pickle.loads(frames[0], buffers=frames[1:])
+
+
+def dumps(value):
+    """Serialize a value to bytes."""
+    frames = serialize(value)
+    lengths = [memoryview(frame).nbytes for frame in frames]
+    header = struct.pack("<%dQ" % (len(frames) + 1), len(frames), *lengths)
+    return b"".join([header] + frames)
+
+
+def loads(data):
+    """Deserialize a value from bytes returned by dumps."""
+    data = memoryview(data).cast("B")
+    (num_frames,) = struct.unpack_from("<Q", data)
+    lengths = struct.unpack_from("<%dQ" % num_frames, data, 8)
+    offset = 8 * (num_frames + 1)
+    frames = []
+    for length in lengths:
+        frames.append(data[offset : offset + length])
+        offset += length
+    return deserialize(frames)
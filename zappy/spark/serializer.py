@@ -0,0 +1,20 @@
+from pyspark.serializers import FramedSerializer
+
+from zappy import serialization
+
+
+class ChunkSerializer(FramedSerializer):
+    """
+    A Spark serializer for RDDs of array chunks, using zappy.serialization, so the data of each chunk is copied
+    once when it is serialized, and not at all when it is deserialized (chunks are read-only). Pass an instance
+    as the serializer argument when creating a SparkContext.
+    """
+
+    def dumps(self, obj):
+        return serialization.dumps(obj)
+
+    def loads(self, obj):
+        return serialization.loads(obj)
+
+    def __repr__(self):
+        return "ChunkSerializer()"
@@ -1,7 +1,10 @@
 import itertools
 import math
+import threading
 import zarr
 
+from zappy import serialization
+
 try:
     from itertools import accumulate
 except ImportError:
@@ -36,6 +39,34 @@ except ImportError:
 #   change.
 
 
+# The number of bytes read from and written to stores by the functions in this module, counted separately for
+# each thread so that they can be attributed to the task running in the thread
+_io_counters = threading.local()
+
+
+def reset_io_counters():
+    _io_counters.bytes_read = 0
+    _io_counters.bytes_written = 0
+
+
+def get_io_counters():
+    """
+    Return the number of bytes read and written by the current thread since reset_io_counters was last called.
+    """
+    return (
+        getattr(_io_counters, "bytes_read", 0),
+        getattr(_io_counters, "bytes_written", 0),
+    )
+
+
+def _count_bytes_read(nbytes):
+    _io_counters.bytes_read = getattr(_io_counters, "bytes_read", 0) + nbytes
+
+
+def _count_bytes_written(nbytes):
+    _io_counters.bytes_written = getattr(_io_counters, "bytes_written", 0) + nbytes
+
+
 def get_chunk_indices(shape, chunks):
     """
     Return all the indices (coordinates) for the chunks in a zarr array, even empty ones.
@@ -58,10 +89,13 @@ def get_chunk_sizes(shape, chunks):
 
 
 def read_zarr_chunk(arr, chunks, chunk_index):
-    return arr[
+    chunk = arr[
         chunks[0] * chunk_index[0] : chunks[0] * (chunk_index[0] + 1),
         chunks[1] * chunk_index[1] : chunks[1] * (chunk_index[1] + 1),
     ]
+    if isinstance(arr, zarr.Array):
+        _count_bytes_read(chunk.nbytes)
+    return chunk
 
 
 def read_chunk(file):
@@ -93,6 +127,7 @@ def write_chunk(file):
         z = zarr.open(file, mode="r+")
         chunk_size = z.chunks
         z[chunk_size[0] * index : chunk_size[0] * (index + 1), :] = arr
+        _count_bytes_written(arr.nbytes)
 
     return write_one_chunk
 
@@ -112,6 +147,7 @@ def write_n_chunk_copies(file, size, ncopies):
                 chunk_size[0] * effective_index : chunk_size[0] * (effective_index + 1),
                 :,
             ] = arr
+        _count_bytes_written(arr.nbytes * ncopies)
 
     return write_n_chunks
 
@@ -134,6 +170,7 @@ def write_chunk_gcs(gcs_path, gcs_project, gcs_token):
         z = zarr.open(store, mode="r+")
         chunk_size = z.chunks
         z[chunk_size[0] * index : chunk_size[0] * (index + 1), :] = arr
+        _count_bytes_written(arr.nbytes)
 
     return write_one_chunk
 
@@ -157,10 +194,80 @@ def write_n_chunk_copies_gcs(gcs_path, gcs_project, gcs_token, size, ncopies):
                 chunk_size[0] * effective_index : chunk_size[0] * (effective_index + 1),
                 :,
             ] = arr
+        _count_bytes_written(arr.nbytes * ncopies)
 
     return write_n_chunks
 
 
+class StoreLocation(object):
+    """
+    The location of a directory store, which is passed to tasks instead of the store, and reopened by open_store.
+    """
+
+    def __init__(self, path, nested=False):
+        self.path = path
+        self.nested = nested
+
+    def open(self):
+        if self.nested:
+            return zarr.storage.NestedDirectoryStore(self.path)
+        return zarr.storage.DirectoryStore(self.path)
+
+
+def store_location(store):
+    """
+    Return a small reference to a store to pass to tasks: a StoreLocation for a directory store (including a
+    TempStore), or the store itself for other stores, which can't be reopened from a path (such as in-memory stores).
+    """
+    if isinstance(store, zarr.storage.DirectoryStore):
+        return StoreLocation(
+            store.path, isinstance(store, zarr.storage.NestedDirectoryStore)
+        )
+    return store
+
+
+def open_store(location):
+    """
+    Return the store for a reference returned by store_location.
+    """
+    if isinstance(location, StoreLocation):
+        return location.open()
+    return location
+
+
+def store_key(group, *parts):
+    """
+    Return the key for an entry below the given Zarr group in the group's store.
+    """
+    return "/".join([str(part) for part in (group.path,) + parts if part != ""])
+
+
+def store_value(store, key, value):
+    """
+    Write a picklable value, such as an array chunk or a partial result, to a store under the given key. Unlike a
+    Zarr array, the value may be an array with no rows.
+    """
+    data = serialization.dumps(value)
+    store[key] = data
+    _count_bytes_written(len(data))
+
+
+def load_value(store, key):
+    """
+    Read a value written by store_value. Arrays in the value may be read-only views of the stored bytes.
+    """
+    data = store[key]
+    _count_bytes_read(len(data))
+    return serialization.loads(data)
+
+
+def delete_values(store, prefix):
+    """
+    Delete all the values under the given key prefix.
+    """
+    zarr.storage.rmdir(store, prefix)
+
+
 def calculate_partition_boundaries(chunks, partition_row_counts):
     # Generate a list of offsets, so that k[i] is the number of rows before the i-th partition
     # Then turn this into a row range for each partition